@@ -0,0 +1,180 @@
+# === cash_aggregator.py ===
+# 機群現金彙總 / Incremental fleet-wide aggregation of parsed count files
+import threading
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timedelta
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _new_group():
+    return {"TotalNotes": 0, "RejectNotes": 0, "Amount": defaultdict(int)}
+
+
+class CashAggregator:
+    """
+    Running totals over count files in format_to_new_json_structure layout.
+
+    Each file is folded in with a single pass over its notes; nothing is
+    rescanned, so snapshot() can be called at any moment for live totals.
+    """
+
+    def __init__(self, bucket_seconds=3600, dedup_window=1024):
+        if bucket_seconds <= 0:
+            raise ValueError(f"bucket_seconds must be positive, got {bucket_seconds}")
+        self.bucket_seconds = bucket_seconds
+        self._lock = threading.Lock()
+        # 每台機器只記最近的檔案序號, 集合供 O(1) 查詢 / recent NumberCountFile values per machine,
+        # bounded by the deque; the set mirrors it for O(1) lookups
+        self._recent = defaultdict(lambda: deque(maxlen=dedup_window))
+        self._recent_set = defaultdict(set)
+        self.files = 0
+        self.duplicates = 0
+        self.totals = _new_group()
+        self.by_currency = defaultdict(Counter)   # currency -> nominal -> notes
+        self.by_cashier = defaultdict(_new_group)
+        self.by_machine = defaultdict(_new_group)
+        self.by_bucket = defaultdict(_new_group)
+        self.note_errors = Counter()
+        self.note_errors_by_machine = defaultdict(Counter)
+
+    def _bucket(self, start_time):
+        # 以機器本地時間取整, 86400 即本地日 / floor the naive local time, so 86400 is a local day
+        try:
+            dt = datetime.strptime(start_time, TIME_FORMAT)
+        except (TypeError, ValueError):
+            return "unknown"
+        if self.bucket_seconds >= 86400:
+            days = self.bucket_seconds // 86400
+            ordinal = dt.toordinal()
+            floored = datetime.fromordinal(ordinal - (ordinal - 1) % days)
+        else:
+            midnight = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+            seconds = (dt - midnight).seconds
+            floored = midnight + timedelta(seconds=seconds - seconds % self.bucket_seconds)
+        return floored.strftime(TIME_FORMAT)
+
+    def add(self, count):
+        # 加入一份計數檔 / Fold one count file in; returns False for None or a resend
+        if count is None:
+            return False
+        settings = count["CountSettings"]
+        result = count["CountResult"]
+        machine = result.get("MachineSerialNumber", "")
+        cashier = settings.get("CashierId", "")
+        number = settings.get("NumberCountFile", "")
+
+        with self._lock:
+            if number:
+                recent = self._recent[machine]
+                recent_set = self._recent_set[machine]
+                if number in recent_set:
+                    self.duplicates += 1
+                    return False
+                if recent and len(recent) == recent.maxlen:
+                    recent_set.discard(recent[0])
+                recent.append(number)
+                recent_set.add(number)
+            self.files += 1
+
+            groups = (self.totals, self.by_cashier[cashier], self.by_machine[machine],
+                      self.by_bucket[self._bucket(result.get("StartTime"))])
+            machine_errors = self.note_errors_by_machine[machine]
+            for note in result["Notes"]:
+                rejected = note["rejected"]
+                note_error = note["noteError"]
+                if note_error:
+                    self.note_errors[note_error] += 1
+                    machine_errors[note_error] += 1
+                currency = note["currency"]
+                counted = not rejected and currency
+                if counted:
+                    self.by_currency[currency][note["nominal"]] += 1
+                for group in groups:
+                    group["TotalNotes"] += 1
+                    if rejected:
+                        group["RejectNotes"] += 1
+                    elif counted:
+                        group["Amount"][currency] += note["nominal"]
+        return True
+
+    def snapshot(self):
+        # 取得目前彙總 / Consistent copy of every running total
+        with self._lock:
+            return {
+                "Files": self.files,
+                "Duplicates": self.duplicates,
+                "Totals": _export_group(self.totals),
+                "ByCurrency": _export_currencies(self.by_currency),
+                "ByCashier": {k: _export_group(g) for k, g in self.by_cashier.items()},
+                "ByMachine": {k: _export_group(g) for k, g in self.by_machine.items()},
+                "ByTimeBucket": {k: _export_group(g) for k, g in sorted(self.by_bucket.items())},
+                "NoteErrors": dict(self.note_errors),
+                "NoteErrorsByMachine": {k: dict(c) for k, c in self.note_errors_by_machine.items()},
+            }
+
+
+def _merge_group(into, group):
+    into["TotalNotes"] += group["TotalNotes"]
+    into["RejectNotes"] += group["RejectNotes"]
+    for entry in group["TotalAmount"]:
+        into["Amount"][entry["Currency"]] += entry["Amount"]
+
+
+def merge_snapshots(snapshots):
+    # 合併多個行程的快照 / Combine snapshot() results from several processes
+    totals = _new_group()
+    by_currency = defaultdict(Counter)
+    groups = {"ByCashier": defaultdict(_new_group), "ByMachine": defaultdict(_new_group),
+              "ByTimeBucket": defaultdict(_new_group)}
+    note_errors = Counter()
+    note_errors_by_machine = defaultdict(Counter)
+    files = duplicates = 0
+    for snap in snapshots:
+        files += snap["Files"]
+        duplicates += snap["Duplicates"]
+        _merge_group(totals, snap["Totals"])
+        for currency, info in snap["ByCurrency"].items():
+            by_currency[currency].update(info["ByNominal"])
+        for name, merged in groups.items():
+            for key, group in snap[name].items():
+                _merge_group(merged[key], group)
+        note_errors.update(snap["NoteErrors"])
+        for machine, errors in snap["NoteErrorsByMachine"].items():
+            note_errors_by_machine[machine].update(errors)
+    return {
+        "Files": files,
+        "Duplicates": duplicates,
+        "Totals": _export_group(totals),
+        "ByCurrency": _export_currencies(by_currency),
+        "ByCashier": {k: _export_group(g) for k, g in groups["ByCashier"].items()},
+        "ByMachine": {k: _export_group(g) for k, g in groups["ByMachine"].items()},
+        "ByTimeBucket": {k: _export_group(g) for k, g in sorted(groups["ByTimeBucket"].items())},
+        "NoteErrors": dict(note_errors),
+        "NoteErrorsByMachine": {k: dict(c) for k, c in note_errors_by_machine.items()},
+    }
+
+
+def _export_currencies(by_currency):
+    return {
+        currency: {
+            "Notes": sum(nominals.values()),
+            "Amount": sum(n * c for n, c in nominals.items()),
+            "ByNominal": dict(sorted(nominals.items())),
+        }
+        for currency, nominals in by_currency.items()
+    }
+
+
+def _export_group(group):
+    total = group["TotalNotes"]
+    return {
+        "TotalNotes": total,
+        "RejectNotes": group["RejectNotes"],
+        "RejectRate": group["RejectNotes"] / total if total else 0.0,
+        "TotalAmount": [{"Currency": c, "Amount": a} for c, a in group["Amount"].items()],
+    }
+
+
+# 預設共用實例 / Process-wide aggregator fed by parse_command and DeviceProtocol
+default_aggregator = CashAggregator()
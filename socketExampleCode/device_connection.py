@@ -0,0 +1,121 @@
+# === device_connection.py ===
+# 同步設備連線 / Blocking device connection shared by the fleet runner and headless CLI
+import socket
+from packet_builder import build_frame, get_full_packet_length, ACK, SocketCommand, SocketCommandType
+from packet_parser import is_bcc_valid, decode_response
+import cash_aggregator
+import tracing
+
+# 會有資料回應的查詢命令 / Queries answered with a RESPONSE frame after the ACK
+QUERY_COMMANDS = {
+    SocketCommand.SOCKET_ACTION_CMD_ASK_STATUS,
+    SocketCommand.SOCKET_ACTION_CMD_CONFIG_READ,
+    SocketCommand.SOCKET_ACTION_CMD_ASK_DATE_TIME,
+    SocketCommand.SOCKET_ACTION_CMD_GET_DETECTION_MODE,
+    SocketCommand.SOCKET_ACTION_GET_VARUIOS_MARAMETERS,
+    SocketCommand.SOCKET_SETUP_CMD_SELECT_CURRENCY,
+    SocketCommand.SOCKET_SETUP_CMD_SET_CURRENCY_MODE,
+    SocketCommand.SOCKET_SETUP_CMD_SET_DETECTION_MODE,
+}
+
+METRIC_KEYS = ("commands", "errors", "skipped", "events", "bytes_in", "bytes_out", "connects", "connect_failures",
+               "busy_seconds", "cache_hits", "cache_misses", "cache_collapsed")
+
+
+def new_metrics():
+    return dict.fromkeys(METRIC_KEYS, 0)
+
+
+def set_nodelay(sock):
+    # 關閉 Nagle: ACK 後緊接下一個命令不可被延遲 / disable Nagle so a command after our ACK is not held back
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class DeviceProtocol:
+    """
+    Socket-free request/response state for one device.
+
+    request() returns the frame to send; receive() consumes raw bytes and
+    returns the ACK bytes to write back. done and value describe the
+    outstanding command. Unsolicited responses are counted as events and
+    BANKNOTE_DATA count files are fed to the aggregator.
+    """
+
+    def __init__(self, metrics=None, aggregator=None):
+        self.metrics = metrics if metrics is not None else new_metrics()
+        self.aggregator = aggregator if aggregator is not None else cash_aggregator.default_aggregator
+        self.buffer = bytearray()
+        self.cmd = None
+        self.want_response = False
+        self.done = True
+        self.value = None
+
+    def request(self, cmd, data=None):
+        frame = build_frame(cmd, data)
+        self.cmd = cmd
+        self.want_response = cmd in QUERY_COMMANDS
+        self.done = False
+        self.value = None
+        self.metrics["bytes_out"] += len(frame)
+        return frame
+
+    def receive(self, data):
+        self.metrics["bytes_in"] += len(data)
+        self.buffer.extend(data)
+        replies = bytearray()
+        while self.buffer:
+            expected_len = get_full_packet_length(self.buffer, 0, len(self.buffer))
+            if expected_len == -1 or len(self.buffer) < expected_len:
+                break
+            packet = bytes(self.buffer[:expected_len])
+            del self.buffer[:expected_len]
+            if len(packet) == 1 and packet[0] == ACK:
+                if not self.done and not self.want_response:
+                    self.done = True
+                continue
+            if not is_bcc_valid(packet):
+                continue
+            replies.append(ACK)
+            if packet[3] != SocketCommandType.RESPONSE_CMD_FORMAT:
+                continue
+            value = decode_response(packet[2], packet[9:-2])
+            if packet[2] == SocketCommand.SOCKET_RESPONSE_CMD_BANKNOTE_DATA:
+                self.aggregator.add(value)
+            if not self.done and self.want_response and packet[2] == self.cmd:
+                self.value = value
+                self.done = True
+                continue
+            self.metrics["events"] += 1
+        return bytes(replies)
+
+
+class DeviceConnection:
+    # 同步的單一設備連線 / Blocking request/response connection to one device
+    def __init__(self, host, port, timeout=30, metrics=None):
+        self.name = f"{host}:{port}"
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        set_nodelay(self.sock)
+        self.protocol = DeviceProtocol(metrics)
+        self.metrics = self.protocol.metrics
+        self.metrics["connects"] += 1
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def execute(self, cmd, data):
+        # 送出命令並等待 ACK (與查詢回應) / Send, wait for ACK and, for queries, the response
+        # 子 span (BCC 檢查, 解析) 繼承機器與命令 / child spans (BCC check, decoders) inherit machine and cmd
+        with tracing.span("execute", self.name, cmd):
+            self.sock.sendall(self.protocol.request(cmd, data))
+            with tracing.span("wait_response"):
+                while not self.protocol.done:
+                    data = self.sock.recv(1024 * 1024)
+                    if not data:
+                        raise ConnectionError("device closed the connection")
+                    replies = self.protocol.receive(data)
+                    if replies:
+                        self.sock.sendall(replies)
+            return self.protocol.value
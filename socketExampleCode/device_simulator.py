@@ -0,0 +1,147 @@
+# === device_simulator.py ===
+# 本機模擬設備 / Local simulated counters for testing and benchmarking
+import argparse
+import socketserver
+import struct
+import threading
+import time
+from datetime import datetime
+from packet_builder import build_response, get_full_packet_length, ACK, SocketCommand, DEFAULT_DETECTION_MODE
+from packet_parser import is_bcc_valid
+from device_connection import set_nodelay
+from data.config_data import ConfigData
+
+
+def _fixed(text, size):
+    return text.encode('utf-8')[:size].ljust(size, b'\x00')
+
+
+def build_status_payload(serial):
+    # 依 parse_machine_status 格式產生狀態 / Status payload in parse_machine_status layout
+    buf = bytearray()
+    buf += _fixed(serial, 10)
+    buf += _fixed(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 20)
+    buf += _fixed("SIMHASH0", 8)
+    buf += struct.pack(">I", 60301516)
+    buf += bytes([0])                       # AuditMode
+    buf += bytes([0])                       # MachineState OK
+    buf += struct.pack(">I", 0)             # Status code
+    buf += _fixed("NC7500", 20)
+    buf += _fixed("DSP-1.0", 10)
+    buf += _fixed("FPGA-1.0", 10)
+    buf += _fixed("GUI-1.0", 10)
+    buf += bytes([1])                       # Nation count
+    buf += _fixed("RUB", 3)
+    buf += _fixed("RUB-1.0", 10)
+    return bytes(buf)
+
+
+def build_count_payload(serial, number, notes, cashier="CASHIER01"):
+    # 依 parse_custom_data 格式產生計數檔 / Count file in parse_custom_data layout
+    # notes: [(currency, nominal, note_error, rejected)]
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    buf = bytearray()
+    buf += _fixed(cashier, 20)
+    buf += _fixed("1000", 5)
+    buf += _fixed("MIX", 16)
+    buf += _fixed("SIMH", 4)
+    buf += struct.pack(">Q", number)
+    buf += _fixed("{00000000-0000-0000-0000-%012d}" % number, 38)
+    buf += _fixed(serial, 10)
+    buf += _fixed(now, 20)
+    buf += _fixed(now, 20)
+    buf += struct.pack(">I", len(notes))
+    for currency, nominal, note_error, rejected in notes:
+        record = _fixed(currency, 3) + struct.pack(">I", nominal) + _fixed("2017", 10) \
+            + _fixed("AA%08d" % number, 20) + struct.pack(">I", note_error) + bytes([1 if rejected else 0])
+        buf += record.ljust(60, b'\x00')
+    return bytes(buf)
+
+
+# 每次 START_KEY 模擬的一疊鈔票 / Bundle counted on every simulated START_KEY
+SIM_NOTES = [("RUB", 100, 0, False), ("RUB", 500, 0, False), ("RUB", 1000, 0, False), ("", 0, 7, True)]
+
+
+class _DeviceHandler(socketserver.BaseRequestHandler):
+    # 模擬單一連線 / Serve one client connection
+    def handle(self):
+        sock = self.request
+        set_nodelay(sock)
+        serial = self.server.serial
+        self.count_files = 0
+        buffer = bytearray()
+        while True:
+            try:
+                data = sock.recv(1024 * 1024)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer.extend(data)
+            while buffer:
+                expected_len = get_full_packet_length(buffer, 0, len(buffer))
+                if expected_len == -1 or len(buffer) < expected_len:
+                    break
+                packet = bytes(buffer[:expected_len])
+                del buffer[:expected_len]
+                if len(packet) == 1 and packet[0] == ACK:
+                    continue
+                if not is_bcc_valid(packet):
+                    continue
+                if self.server.delay:
+                    time.sleep(self.server.delay)
+                sock.sendall(bytes([ACK]) + self.answer(packet[2], serial))
+
+    def answer(self, cmd, serial):
+        if cmd == SocketCommand.SOCKET_ACTION_CMD_ASK_STATUS:
+            return build_response(cmd, build_status_payload(serial))
+        if cmd == SocketCommand.SOCKET_ACTION_CMD_CONFIG_READ:
+            return build_response(cmd, ConfigData.to_bytes())
+        if cmd == SocketCommand.SOCKET_ACTION_CMD_ASK_DATE_TIME:
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            return build_response(cmd, now.encode('utf-8'))
+        if cmd == SocketCommand.SOCKET_ACTION_CMD_START_KEY:
+            # ACK 之後主動送出計數結果 / count result pushed unsolicited after the ACK
+            self.count_files += 1
+            payload = build_count_payload(serial, self.count_files, SIM_NOTES)
+            return build_response(SocketCommand.SOCKET_RESPONSE_CMD_BANKNOTE_DATA, payload)
+        if cmd == SocketCommand.SOCKET_ACTION_CMD_GET_DETECTION_MODE:
+            return build_response(cmd, bytes([1] + DEFAULT_DETECTION_MODE))
+        if cmd == SocketCommand.SOCKET_ACTION_GET_VARUIOS_MARAMETERS:
+            return build_response(cmd, bytes([1, 0, 1, 0, 0]))
+        if cmd in (SocketCommand.SOCKET_SETUP_CMD_SELECT_CURRENCY,
+                   SocketCommand.SOCKET_SETUP_CMD_SET_CURRENCY_MODE,
+                   SocketCommand.SOCKET_SETUP_CMD_SET_DETECTION_MODE):
+            return build_response(cmd, bytes([0]))
+        return b""
+
+
+class _DeviceServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_simulators(count, host="127.0.0.1", delay=0.0):
+    # 啟動多台模擬設備 / Start simulated devices on ephemeral ports, returns [(host, port, serial)]
+    devices = []
+    for i in range(count):
+        server = _DeviceServer((host, 0), _DeviceHandler)
+        server.serial = f"SIM{i:07d}"
+        server.delay = delay
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        devices.append((host, server.server_address[1], server.serial))
+    return devices
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated banknote counters")
+    parser.add_argument("--count", type=int, default=1, help="Number of simulated devices")
+    parser.add_argument("--delay", type=float, default=0.0, help="Per-command processing delay in seconds")
+    args = parser.parse_args()
+    for host, port, serial in start_simulators(args.count, delay=args.delay):
+        print(f"{serial} {host}:{port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,465 @@
+# === fleet_runner.py ===
+# 多行程機群執行器 / Sharded multi-process runner for a fleet of counters
+import argparse
+import errno
+import json
+import multiprocessing
+import os
+import queue
+import selectors
+import socket
+import sys
+import time
+import zlib
+from collections import deque
+from packet_builder import SocketCommand
+from device_connection import DeviceProtocol, METRIC_KEYS, new_metrics, set_nodelay
+import cash_aggregator
+from status_cache import StatusCache, WRITE_COMMANDS
+
+
+def machine_key(host, port, serial=None):
+    # 機器識別鍵 / Shard key: serial number when known, else host:port
+    return serial or f"{host}:{port}"
+
+
+def shard_for(key, shards):
+    # 穩定雜湊, 跨行程一致 / Stable across processes, unlike hash()
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+
+# 連線失敗後的退避秒數 / Reconnect backoff after a connection failure
+BACKOFF_INITIAL = 1.0
+BACKOFF_MAX = 60.0
+
+
+class _ShardMachine:
+    # 工作行程內的一台設備: 非阻塞連線與待辦佇列 / One device inside a worker: non-blocking socket plus job FIFO
+    def __init__(self, worker, key, host, port):
+        self.worker = worker
+        self.key = key
+        self.host = host
+        self.port = port
+        self.jobs = deque()
+        self.sock = None
+        self.connecting = False
+        self.protocol = None
+        self.current = None          # (job_id, cmd, started)
+        self.outbuf = bytearray()
+        self.deadline = None
+        self.failures = 0
+        self.backoff_until = 0.0
+        self.last_error = None
+        # 同一機器的查詢共用快取與進行中請求 / per-machine TTL cache with single-flight queries
+        self.cache = StatusCache(ttl=worker.cache_ttl, timeout=worker.timeout)
+        self.leaders = {}            # cmd -> job_id that queries the device for the cache
+        self.followers = {}          # cmd -> [(job_id, started)] waiting on the leader
+        self.writes = 0              # 佇列中或執行中的寫入命令 / write commands queued or running
+
+    def enqueue(self, job_id, cmd, data):
+        if cmd in WRITE_COMMANDS:
+            # 寫入一進佇列即失效, 之後的查詢不可讀到舊值 / invalidate on queueing so later reads never see old values
+            self.writes += 1
+            self.cache.invalidate()
+        elif data is None and not self.writes and self.cache.ttl.get(cmd, 0) > 0:
+            now = time.monotonic()
+            state, value = self.cache.begin(cmd)
+            if state == "hit":
+                self.worker.finish(self, job_id, cmd, now, value=value)
+                return
+            if state == "wait":
+                self.followers.setdefault(cmd, []).append((job_id, now))
+                return
+            self.leaders[cmd] = job_id
+        self.jobs.append((job_id, cmd, data))
+        self.pump()
+
+    def complete(self, job_id, cmd, started, value=None, error=None):
+        # 完成命令並回覆同命令的等待者 / Finish a job and answer followers of the same query
+        if cmd in WRITE_COMMANDS:
+            self.writes -= 1
+        elif self.leaders.get(cmd) == job_id:
+            del self.leaders[cmd]
+            if error is None:
+                self.cache.deliver(cmd, value)
+            else:
+                self.cache.abandon(cmd)
+            for follower_id, follower_started in self.followers.pop(cmd, ()):
+                self.worker.finish(self, follower_id, cmd, follower_started, value=value, error=error)
+        self.worker.finish(self, job_id, cmd, started, value=value, error=error)
+
+    def pump(self):
+        # 啟動下一個命令 / Start the next job if idle
+        if self.current is not None or self.connecting or not self.jobs:
+            return
+        now = time.monotonic()
+        if now < self.backoff_until:
+            # 退避中的設備立即失敗, 不重連 / fail fast instead of reconnecting a dead device
+            while self.jobs:
+                job_id, cmd, _ = self.jobs.popleft()
+                self.worker.metrics["skipped"] += 1
+                self.complete(job_id, cmd, now, error=f"backing off after: {self.last_error}")
+            return
+        if self.sock is None:
+            self.connect(now)
+            return
+        job_id, cmd, data = self.jobs.popleft()
+        self.current = (job_id, cmd, now)
+        self.deadline = now + self.worker.timeout
+        self.write(self.protocol.request(cmd, data))
+
+    def connect(self, now):
+        try:
+            family, socktype, proto, _, address = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)[0]
+            sock = socket.socket(family, socktype, proto)
+        except OSError as e:
+            self.fail_connection(str(e))
+            return
+        sock.setblocking(False)
+        set_nodelay(sock)
+        err = sock.connect_ex(address)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            self.fail_connection(os.strerror(err))
+            return
+        self.sock = sock
+        self.connecting = True
+        self.deadline = now + self.worker.timeout
+        self.worker.selector.register(sock, selectors.EVENT_WRITE, self)
+
+    def write(self, data):
+        self.outbuf.extend(data)
+        self.worker.selector.modify(self.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, self)
+
+    def on_ready(self, mask):
+        try:
+            if self.connecting:
+                err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    raise OSError(err, os.strerror(err))
+                self.connecting = False
+                self.deadline = None
+                self.protocol = DeviceProtocol(self.worker.metrics)
+                self.worker.metrics["connects"] += 1
+                self.worker.selector.modify(self.sock, selectors.EVENT_READ, self)
+                self.pump()
+                return
+            if mask & selectors.EVENT_READ:
+                data = self.sock.recv(1024 * 1024)
+                if not data:
+                    raise ConnectionError("device closed the connection")
+                replies = self.protocol.receive(data)
+                if replies:
+                    self.outbuf.extend(replies)
+                if self.current is not None and self.protocol.done:
+                    job_id, cmd, started = self.current
+                    self.current = None
+                    self.deadline = None
+                    self.failures = 0
+                    self.complete(job_id, cmd, started, value=self.protocol.value)
+                    self.pump()
+            if self.outbuf:
+                try:
+                    sent = self.sock.send(self.outbuf)
+                except (BlockingIOError, InterruptedError):
+                    # 送出緩衝已滿, 等下一次可寫 / send buffer full; keep the bytes for the next write event
+                    sent = 0
+                del self.outbuf[:sent]
+            if self.sock is not None and not self.outbuf:
+                self.worker.selector.modify(self.sock, selectors.EVENT_READ, self)
+            elif self.sock is not None:
+                self.worker.selector.modify(self.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, self)
+        except (OSError, ConnectionError) as e:
+            self.fail_connection(str(e))
+
+    def check_timeout(self, now):
+        if self.deadline is not None and now >= self.deadline:
+            self.fail_connection("timeout")
+
+    def fail_connection(self, error):
+        # 關閉連線並進入退避 / Drop the socket, fail the current job and back off
+        now = time.monotonic()
+        connect_failed = self.connecting or self.sock is None
+        if self.sock is not None:
+            try:
+                self.worker.selector.unregister(self.sock)
+            except (KeyError, ValueError):
+                pass
+            self.sock.close()
+        self.sock = None
+        self.connecting = False
+        self.protocol = None
+        self.outbuf = bytearray()
+        self.deadline = None
+        self.failures += 1
+        self.last_error = error
+        self.backoff_until = now + min(BACKOFF_MAX, BACKOFF_INITIAL * 2 ** (self.failures - 1))
+        if self.current is not None:
+            job_id, cmd, started = self.current
+            self.current = None
+            self.complete(job_id, cmd, started, error=error)
+        elif connect_failed:
+            # 觸發連線的命令回報連線錯誤, 其餘才算略過 / the job that triggered the connect gets the connect error
+            self.worker.metrics["connect_failures"] += 1
+            if self.jobs:
+                job_id, cmd, _ = self.jobs.popleft()
+                self.complete(job_id, cmd, now, error=f"connect failed: {error}")
+        self.pump()
+
+    def close(self):
+        if self.sock is not None:
+            self.worker.selector.unregister(self.sock)
+            self.sock.close()
+            self.sock = None
+
+    @property
+    def busy(self):
+        return self.current is not None or self.connecting or bool(self.jobs)
+
+
+class _Worker:
+    # 工作行程事件迴圈: 以 selectors 多工分片內所有連線 / Event loop multiplexing every connection of the shard
+    def __init__(self, shard, jobs, results, timeout, cache_ttl=None):
+        self.shard = shard
+        self.jobs = jobs
+        self.results = results
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.metrics = new_metrics()
+        self.machines = {}
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(jobs, selectors.EVENT_READ, None)
+
+    def finish(self, machine, job_id, cmd, started, value=None, error=None):
+        result = {"machine": machine.key, "shard": self.shard, "cmd": cmd, "ok": error is None}
+        if error is None:
+            result["value"] = value
+        else:
+            result["error"] = error
+            self.metrics["errors"] += 1
+        self.metrics["commands"] += 1
+        self.metrics["busy_seconds"] += time.monotonic() - started
+        self.results.put(("result", job_id, result))
+
+    def handle_message(self, message):
+        kind = message[0]
+        if kind == "metrics":
+            metrics = dict(self.metrics)
+            for machine in self.machines.values():
+                stats = machine.cache.stats()
+                metrics["cache_hits"] += stats["hits"]
+                metrics["cache_misses"] += stats["misses"]
+                metrics["cache_collapsed"] += stats["collapsed"]
+            self.results.put(("metrics", self.shard, metrics))
+            return
+        if kind == "cash":
+            self.results.put(("cash", self.shard, cash_aggregator.default_aggregator.snapshot()))
+            return
+        _, job_id, key, host, port, cmd, data = message
+        machine = self.machines.get(key)
+        if machine is None:
+            machine = self.machines[key] = _ShardMachine(self, key, host, port)
+        machine.enqueue(job_id, cmd, data)
+
+    def run(self):
+        running = True
+        while running or any(m.busy for m in self.machines.values()):
+            deadlines = [m.deadline for m in self.machines.values() if m.deadline is not None]
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            if not running and timeout is None:
+                timeout = 0.1
+            for key, mask in self.selector.select(timeout):
+                if key.data is None:
+                    while running and self.jobs.poll():
+                        message = self.jobs.recv()
+                        if message is None:
+                            running = False
+                            self.selector.unregister(self.jobs)
+                        else:
+                            self.handle_message(message)
+                else:
+                    key.data.on_ready(mask)
+            now = time.monotonic()
+            for machine in list(self.machines.values()):
+                machine.check_timeout(now)
+        for machine in self.machines.values():
+            machine.close()
+
+
+def _worker_main(shard, jobs, results, timeout, quiet, cache_ttl=None):
+    # 工作行程: 擁有連線與解析 / Worker process: owns its connections and parsing
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+    _Worker(shard, jobs, results, timeout, cache_ttl).run()
+
+
+class FleetRunner:
+    """
+    Coordinator that hashes machines onto worker processes.
+
+    Each worker owns the connections of its shard and does all framing,
+    checksumming and parsing, so CPU work spreads over every core. Inside
+    a worker the connections are multiplexed with selectors, so a slow or
+    dead device only delays its own jobs; after a failure it backs off
+    and its jobs fail fast until the backoff expires.
+
+    Polled queries go through a per-machine StatusCache; cache_ttl is a
+    {cmd: seconds} override or one number for every query, 0 disables it.
+    """
+
+    def __init__(self, workers=None, timeout=30, quiet=True, cache_ttl=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.quiet = quiet
+        self.cache_ttl = cache_ttl
+        self._job_pipes = []
+        self._procs = []
+        self._results = None
+        self._pending = {}
+        self._next_id = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._results = multiprocessing.Queue()
+        for shard in range(self.workers):
+            # Pipe 可被工作行程的 selector 監聽 / a Pipe end can be registered with the worker's selector
+            reader, writer = multiprocessing.Pipe(duplex=False)
+            proc = multiprocessing.Process(
+                target=_worker_main,
+                args=(shard, reader, self._results, self.timeout, self.quiet, self.cache_ttl),
+                daemon=True,
+            )
+            proc.start()
+            reader.close()
+            self._job_pipes.append(writer)
+            self._procs.append(proc)
+
+    def stop(self):
+        for jobs in self._job_pipes:
+            jobs.send(None)
+            jobs.close()
+        for proc in self._procs:
+            proc.join(timeout=5)
+        self._job_pipes = []
+        self._procs = []
+
+    def submit(self, host, port, cmd, data=None, serial=None):
+        # 轉送命令到所屬分片 / Route one command to the machine's shard, returns a job id
+        key = machine_key(host, port, serial)
+        job_id = self._next_id
+        self._next_id += 1
+        self._job_pipes[shard_for(key, self.workers)].send(("job", job_id, key, host, port, cmd, data))
+        return job_id
+
+    def collect(self, job_ids):
+        # 依序收集結果 / Wait for the given jobs, results in the same order
+        wanted = set(job_ids)
+        while not wanted.issubset(self._pending):
+            self._receive()
+        return [self._pending.pop(job_id) for job_id in job_ids]
+
+    def run(self, commands):
+        # commands: iterable of (host, port, cmd[, data[, serial]])
+        return self.collect([self.submit(*command) for command in commands])
+
+    def metrics(self):
+        # 合併所有工作行程指標 / Merge metrics from every worker
+        per_shard = self._gather("metrics")
+        merged = new_metrics()
+        for shard_metrics in per_shard.values():
+            for name in METRIC_KEYS:
+                merged[name] += shard_metrics[name]
+        merged["per_shard"] = [per_shard[shard] for shard in sorted(per_shard)]
+        return merged
+
+    def cash_totals(self):
+        # 合併所有工作行程的現金彙總 / Fleet-wide cash totals merged from every worker
+        per_shard = self._gather("cash")
+        return cash_aggregator.merge_snapshots(per_shard[shard] for shard in sorted(per_shard))
+
+    def _gather(self, kind):
+        # 向每個工作行程要一份回覆 / Ask every worker for one reply of this kind
+        for jobs in self._job_pipes:
+            jobs.send((kind,))
+        per_shard = {}
+        while len(per_shard) < len(self._job_pipes):
+            message = self._receive()
+            if message is not None and message[0] == kind:
+                per_shard[message[1]] = message[2]
+        return per_shard
+
+    def _receive(self):
+        try:
+            kind, ident, payload = self._results.get(timeout=self.timeout * 2)
+        except queue.Empty:
+            raise TimeoutError("no response from fleet workers")
+        if kind == "result":
+            self._pending[ident] = payload
+            return None
+        return kind, ident, payload
+
+
+def _parse_target(text):
+    host, _, port = text.rpartition(":")
+    return host, int(port)
+
+
+def _simulator_process(count, delay, ready):
+    from device_simulator import start_simulators
+    sys.stdout = open(os.devnull, "w")
+    ready.put(start_simulators(count, delay=delay))
+    while True:
+        time.sleep(3600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run commands across a fleet of counters")
+    parser.add_argument("targets", nargs="*", help="Devices as host:port")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--rounds", type=int, default=1, help="Polling rounds over the whole fleet")
+    parser.add_argument("--simulate", type=int, default=0, help="Start N local simulated devices instead of targets")
+    parser.add_argument("--start-key", action="store_true", help="Send START_KEY instead of ASK_STATUS and report cash totals")
+    parser.add_argument("--delay", type=float, default=0.0, help="Simulated device processing delay in seconds")
+    parser.add_argument("--no-cache", action="store_true", help="Send every query to the device (throughput runs)")
+    args = parser.parse_args()
+
+    machines = [(host, port, None) for host, port in map(_parse_target, args.targets)]
+    if args.simulate:
+        ready = multiprocessing.Queue()
+        sim = multiprocessing.Process(target=_simulator_process, args=(args.simulate, args.delay, ready), daemon=True)
+        sim.start()
+        machines = ready.get(timeout=30)
+    if not machines:
+        parser.error("no targets given")
+
+    cmd = SocketCommand.SOCKET_ACTION_CMD_START_KEY if args.start_key else SocketCommand.SOCKET_ACTION_CMD_ASK_STATUS
+    commands = [(host, port, cmd, None, serial)
+                for _ in range(args.rounds) for host, port, serial in machines]
+    with FleetRunner(workers=args.workers, cache_ttl=0 if args.no_cache else None) as runner:
+        start = time.perf_counter()
+        results = runner.run(commands)
+        elapsed = time.perf_counter() - start
+        metrics = runner.metrics()
+        cash = runner.cash_totals()
+    failed = sum(1 for r in results if not r["ok"])
+    # 快取命中不算設備查詢 / cache hits and collapsed queries never reached a device
+    device_queries = len(results) - metrics["cache_hits"] - metrics["cache_collapsed"]
+    summary = {
+        "machines": len(machines), "workers": runner.workers, "commands": len(results),
+        "device_queries": device_queries, "failed": failed, "seconds": round(elapsed, 3),
+        "commands_per_second": round(len(results) / elapsed, 1) if elapsed else None,
+        "device_queries_per_second": round(device_queries / elapsed, 1) if elapsed else None,
+        "metrics": {k: v for k, v in metrics.items() if k != "per_shard"},
+        "cash": {"Files": cash["Files"], "Totals": cash["Totals"]},
+    }
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# === headless.py ===
+# 非互動模式 / Non-interactive command runner for scripts and cron
+import contextlib
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from packet_builder import SocketCommand, DEFAULT_DETECTION_MODE, DEFAULT_VARIOUS_PARAMETERS
+
+# 結束碼 / Exit codes
+EXIT_OK = 0
+EXIT_COMMAND_FAILED = 1
+EXIT_USAGE = 2
+EXIT_CONNECT_FAILED = 3
+
+# 命令名稱 -> (命令碼, 資料) / Command name -> (command code, data); data as in build_frame
+COMMANDS = {
+    "heartbeat": (SocketCommand.SOCKET_ACTION_CMD_HEARTBEAT, None),
+    "status": (SocketCommand.SOCKET_ACTION_CMD_ASK_STATUS, None),
+    "config-read": (SocketCommand.SOCKET_ACTION_CMD_CONFIG_READ, None),
+    "date-time": (SocketCommand.SOCKET_ACTION_CMD_ASK_DATE_TIME, None),
+    "start-key": (SocketCommand.SOCKET_ACTION_CMD_START_KEY, None),
+    "clear-key": (SocketCommand.SOCKET_ACTION_CMD_CLEAR_KEY, None),
+    "get-detection-mode": (SocketCommand.SOCKET_ACTION_CMD_GET_DETECTION_MODE, None),
+    "get-parameters": (SocketCommand.SOCKET_ACTION_GET_VARUIOS_MARAMETERS, None),
+    "select-currency": (SocketCommand.SOCKET_SETUP_CMD_SELECT_CURRENCY, [0x00]),
+    "set-currency-mode": (SocketCommand.SOCKET_SETUP_CMD_SET_CURRENCY_MODE, [0x01]),
+    "set-detection-mode": (SocketCommand.SOCKET_SETUP_CMD_SET_DETECTION_MODE, DEFAULT_DETECTION_MODE),
+    "set-parameters": (SocketCommand.SOCKET_SETUP_SET_VARUIOS_MARAMETERS, DEFAULT_VARIOUS_PARAMETERS),
+    "set-add-mode": (SocketCommand.SOCKET_SETUP_SET_ADD_MODE, [0x01]),
+    "set-at-mt-mode": (SocketCommand.SOCKET_SETUP_SET_AT_MT_MODE, [0x01]),
+    "audit-on": (SocketCommand.SOCKET_SETUP_CMD_AUDIT_MODE, [1]),
+    "audit-off": (SocketCommand.SOCKET_SETUP_CMD_AUDIT_MODE, [0]),
+    "set-date-time": (SocketCommand.SOCKET_MULTI_CMD_SET_DATE_TIME, None),  # 資料於送出時產生 / payload built at send time
+}
+
+
+def read_script(path):
+    # 每行一個命令, # 為註解 / One command per line, "#" starts a comment
+    with open(path, encoding="utf-8") as f:
+        lines = (line.split("#", 1)[0].strip() for line in f)
+        return [line for line in lines if line]
+
+
+def _command_data(name):
+    cmd, data = COMMANDS[name]
+    if cmd == SocketCommand.SOCKET_MULTI_CMD_SET_DATE_TIME:
+        data = datetime.now().strftime('%Y-%m-%d %H:%M:%S').encode('utf-8')
+    return cmd, data
+
+
+def run_target(host, port, commands, timeout=30):
+    # 對單一設備依序執行 / Run the command list against one device, in order
+    from device_connection import DeviceConnection
+    report = {"target": f"{host}:{port}", "ok": True, "results": []}
+    try:
+        conn = DeviceConnection(host, port, timeout)
+    except OSError as e:
+        report.update(ok=False, error=f"connect failed: {e}", connected=False)
+        return report
+    try:
+        for name in commands:
+            cmd, data = _command_data(name)
+            start = time.perf_counter()
+            entry = {"command": name}
+            try:
+                entry["value"] = conn.execute(cmd, data)
+                entry["ok"] = True
+            except Exception as e:
+                entry["ok"] = False
+                entry["error"] = str(e)
+                report["ok"] = False
+            entry["ms"] = round((time.perf_counter() - start) * 1000, 2)
+            report["results"].append(entry)
+            if not entry["ok"]:
+                break
+    finally:
+        conn.close()
+    return report
+
+
+def run(targets, commands, timeout=30, verbose=False):
+    """
+    Run commands against every (host, port) target and print one JSON report.
+
+    Returns the process exit code: EXIT_OK, EXIT_COMMAND_FAILED or
+    EXIT_CONNECT_FAILED (any target unreachable).
+    """
+    unknown = [name for name in commands if name not in COMMANDS]
+    if unknown:
+        print(f"Unknown command(s): {', '.join(unknown)}. Known: {', '.join(COMMANDS)}", file=sys.stderr)
+        return EXIT_USAGE
+
+    # 協定除錯輸出導向 stderr 或丟棄, 保持 stdout 為純 JSON / keep stdout pure JSON
+    noise = sys.stderr if verbose else open(os.devnull, "w")
+    with contextlib.redirect_stdout(noise):
+        if len(targets) == 1:
+            reports = [run_target(*targets[0], commands, timeout)]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(32, len(targets))) as pool:
+                reports = list(pool.map(lambda t: run_target(*t, commands, timeout), targets))
+
+    print(json.dumps(reports, indent=2, default=str))
+    if any(r.get("connected") is False for r in reports):
+        return EXIT_CONNECT_FAILED
+    if not all(r["ok"] for r in reports):
+        return EXIT_COMMAND_FAILED
+    return EXIT_OK
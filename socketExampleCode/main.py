@@ -1,14 +1,62 @@
 # === main.py ===
 # Socket 客戶端主程式 / Main program for socket client
+# 重模組延後匯入, 讓 cron 短命令快速啟動 / Heavy modules are imported lazily for fast cron runs
 import argparse
-from socket_client import main_loop
+import contextlib
+import sys
+
+DEFAULT_IP = "192.168.88.204"
+DEFAULT_PORT = 5888
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Socket client for banknote module")
-    parser.add_argument("--ip", type=str, default="192.168.88.204", help="Target IP address") 
-    parser.add_argument("--port", type=int, default=5888, help="Target port")   
-    return parser.parse_args()
+    parser.add_argument("--ip", type=str, action="append", help="Target IP address (repeat for several targets)")
+    parser.add_argument("--port", type=int, action="append", help="Target port (one for all targets, or one per --ip)")
+    parser.add_argument("--trace", type=str, default=None, help="Write a Chrome trace JSON to this file on exit")
+    parser.add_argument("--trace-sample", type=float, default=1.0, help="Fraction of root spans to record (0-1)")
+    parser.add_argument("--run", type=str, nargs="+", metavar="CMD", help="Run commands non-interactively and print JSON (e.g. status date-time)")
+    parser.add_argument("--script", type=str, default=None, help="Run commands from a file, one per line")
+    parser.add_argument("--timeout", type=float, default=30, help="Per-command timeout in seconds (non-interactive)")
+    parser.add_argument("--verbose", action="store_true", help="Echo protocol logs to stderr (non-interactive)")
+    args = parser.parse_args()
+
+    ips = args.ip or [DEFAULT_IP]
+    ports = args.port or [DEFAULT_PORT]
+    if len(ports) == 1:
+        ports = ports * len(ips)
+    if len(ports) != len(ips):
+        parser.error("give one --port for all targets or one per --ip")
+    if len(ips) > 1 and not (args.run or args.script):
+        parser.error("several targets need --run or --script; interactive mode talks to one device")
+    args.targets = list(zip(ips, ports))
+    return args
+
+def run_headless(args):
+    import headless
+    commands = list(args.run or [])
+    if args.script:
+        try:
+            commands += headless.read_script(args.script)
+        except OSError as e:
+            print(f"Cannot read script: {e}", file=sys.stderr)
+            return headless.EXIT_USAGE
+    return headless.run(args.targets, commands, args.timeout, args.verbose)
 
 if __name__ == "__main__":
     args = parse_args()
-    main_loop(args.ip, args.port)
+    if args.trace:
+        import tracing
+        tracing.enable(args.trace_sample)
+    try:
+        if args.run or args.script:
+            exit_code = run_headless(args)
+        else:
+            from socket_client import main_loop
+            main_loop(*args.targets[0])
+            exit_code = 0
+    finally:
+        if args.trace:
+            # stdout 保留給 JSON 結果 / stdout is reserved for the JSON report
+            with contextlib.redirect_stdout(sys.stderr):
+                tracing.export_chrome_trace(args.trace)
+    sys.exit(exit_code)
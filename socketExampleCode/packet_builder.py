@@ -84,7 +84,113 @@ def build_multi(cmd_type, data):
     packet += bytes([bcc2])
     return packet
 
+def build_response(cmd_type, data):
+    # 建立設備回應封包 (模擬器用) / Build device RESPONSE packet (used by the simulator)
+    length = len(data)
+    header = struct.pack("<BBBBI", STX, STN, cmd_type, SocketCommandType.RESPONSE_CMD_FORMAT, length)
+    bcc1 = calculate_bcc(header, 7)
+    packet = header + bytes([bcc1]) + data + bytes([ETX])
+    bcc2 = sum(packet[1:]) % 0x80
+    packet += bytes([bcc2])
+    return packet
+
 def calculate_bcc(byte_list, size):
     # 計算 BCC 校驗碼 / Calculate BCC
     return sum(byte_list[1:size]) % 0x80
 
+
+def get_full_packet_length(data: bytes, offset: int, available: int) -> int:
+    # 計算完整封包長度, 資料不足回傳 -1 / Length of the frame at offset, -1 if incomplete
+    # ACK 可能與下一個封包黏在一起 / ACK may arrive coalesced with the next frame
+    if available >= 1 and data[offset] == ACK:
+        return 1
+
+    if available < 5:
+        return -1
+    if data[offset] != STX:
+        return -1
+
+    md = data[offset + 3]
+
+    if md == SocketCommandType.ACTION_CMD_FORMAT:
+        return 6
+
+    elif md == SocketCommandType.SETUP_CMD_FORMAT:
+        if available >= 6:
+            length = data[offset + 4]
+            return 7 + length
+
+    elif md == SocketCommandType.MULTI_PURPOSE_CMD_FORMAT:
+        if available >= 8:
+            length = (
+                data[offset + 4]
+                | (data[offset + 5] << 8)
+                | (data[offset + 6] << 16)
+                | (data[offset + 7] << 24)
+            )
+            return 8 + length + 3
+
+    elif md == SocketCommandType.RESPONSE_CMD_FORMAT:
+        if available >= 8:
+            length = (
+                data[offset + 4]
+                | (data[offset + 5] << 8)
+                | (data[offset + 6] << 16)
+                | (data[offset + 7] << 24)
+            )
+            return 8 + length + 3
+
+    return -1
+
+
+# 預設偵測模式參數 / Default SET_DETECTION_MODE parameters
+DEFAULT_DETECTION_MODE = [
+    0x01,  # SortOn: enable sorting
+    0x00,  # FaceOn: disable face detection
+    0x00,  # OrntOn: disable orientation check
+    0x01,  # EmissionOn: enable UV/IR emission
+    0x00,  # FitMode: COMPASS_FIT_OFF (0) 0 FIT Disable, 1 ATM, 2 FIT, 3 UNFIT, 4 TAPE
+    0x01   # SerialMode: COMPASS_SN_OFF (0)  0 Serial Disable, 1 Serial Enable, 2 Serial Compare, 3 TITO Enable, 4 CHECK Enable
+]
+
+# 預設雜項參數 / Default SET_VARUIOS_MARAMETERS parameters
+DEFAULT_VARIOUS_PARAMETERS = [
+    0x01,  # MotorSpeed: (0 = LOW, 1 = MEDIUM, 2 = HIGH, 3 = ULTRA)
+    0x01,  # SoundOn: ON
+    0x00   # AutoPrintOn: OFF
+]
+
+# 固定封包只建立一次 / Constant frames, built once at import
+ACTION_FRAMES = {
+    cmd: build_action(cmd) for cmd in (
+        SocketCommand.SOCKET_ACTION_CMD_START_KEY,
+        SocketCommand.SOCKET_ACTION_CMD_CLEAR_KEY,
+        SocketCommand.SOCKET_ACTION_GET_VARUIOS_MARAMETERS,
+        SocketCommand.SOCKET_ACTION_CMD_GET_DETECTION_MODE,
+        SocketCommand.SOCKET_ACTION_CMD_HEARTBEAT,
+        SocketCommand.SOCKET_ACTION_CMD_ASK_STATUS,
+        SocketCommand.SOCKET_ACTION_CMD_CONFIG_READ,
+        SocketCommand.SOCKET_ACTION_CMD_ASK_DATE_TIME,
+    )
+}
+
+SETUP_FRAMES = {
+    (cmd, tuple(params)): build_setup(cmd, params) for cmd, params in (
+        (SocketCommand.SOCKET_SETUP_CMD_SELECT_CURRENCY, [0x00]),
+        (SocketCommand.SOCKET_SETUP_CMD_SET_CURRENCY_MODE, [0x01]),
+        (SocketCommand.SOCKET_SETUP_CMD_SET_DETECTION_MODE, DEFAULT_DETECTION_MODE),
+        (SocketCommand.SOCKET_SETUP_SET_VARUIOS_MARAMETERS, DEFAULT_VARIOUS_PARAMETERS),
+        (SocketCommand.SOCKET_SETUP_SET_ADD_MODE, [0x01]),
+        (SocketCommand.SOCKET_SETUP_SET_AT_MT_MODE, [0x01]),
+        (SocketCommand.SOCKET_SETUP_CMD_AUDIT_MODE, [0x01]),
+        (SocketCommand.SOCKET_SETUP_CMD_AUDIT_MODE, [0x00]),
+    )
+}
+
+def build_frame(cmd_type, data=None):
+    # 依資料型態選擇封包格式 / None -> ACTION, list -> SETUP, bytes -> MULTI
+    if data is None:
+        return ACTION_FRAMES.get(cmd_type) or build_action(cmd_type)
+    if isinstance(data, (bytes, bytearray)):
+        return build_multi(cmd_type, bytes(data))
+    return SETUP_FRAMES.get((cmd_type, tuple(data))) or build_setup(cmd_type, data)
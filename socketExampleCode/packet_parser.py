@@ -3,10 +3,17 @@
 # 封包解析器 / Parses received packets
 import struct
 import json
+import threading
 from collections import defaultdict
 from packet_builder import SocketCommand, SocketCommandType, calculate_bcc, ACK
 from data.config_data import ConfigData
+import status_cache
+import tracing
+from cash_aggregator import default_aggregator
 
+_config_lock = threading.Lock()
+
+@tracing.traced("is_bcc_valid")
 def is_bcc_valid(data):
     # 驗證 BCC 正確性 / Validate BCC checksums
     if len(data) < 4:
@@ -35,6 +42,7 @@ def is_bcc_valid(data):
 # This module handles parsing of the machine status report based on NC7500 response
 # The output JSON must follow a strict structure defined by the host system (Sberbank/CS SW)
 
+@tracing.traced("parse_machine_status")
 def parse_machine_status(data):
     """
     Parses binary status data from NC7500 and returns structured JSON.
@@ -130,6 +138,7 @@ def parse_machine_status(data):
         return None
 
 
+@tracing.traced("parse_custom_data")
 def parse_custom_data(data):
     # 解析自定格式資料 / Parse banknote detail record
     try:
@@ -166,18 +175,21 @@ def parse_custom_data(data):
         print(f"[PARSE] Error parsing byte[] format: {e}")
         return None
 
+@tracing.traced("format_to_new_json_structure")
 def format_to_new_json_structure(parsed):
     # 格式化輸出 JSON 結構 / Format parsed result into JSON
     if parsed is None:
         return None
     entity = parsed["entity"]
     details = parsed["details"]
-    reject_count = sum(1 for d in details if d["rejected"])
+    reject_count = 0
     total_count = len(details)
 
     currency_amount = defaultdict(int)
     for d in details:
-        if not d["rejected"] and d["currency"]:
+        if d["rejected"]:
+            reject_count += 1
+        elif d["currency"]:
             currency_amount[d["currency"]] += d["nominal"]
 
     return {
@@ -195,7 +207,87 @@ def format_to_new_json_structure(parsed):
         }
     }
 
+@tracing.traced("parse_various_parameters")
+def parse_various_parameters(data):
+    # 解析雜項參數 / GET_VARUIOS_MARAMETERS response
+    if len(data) < 5:
+        print("[PARSE] GET_VARUIOS_MARAMETERS data too short:", data)
+        return None
+    return {
+        "MotorSpeed": data[0],          # 0 = LOW, 1 = MEDIUM, 2 = HIGH, 3 = ULTRA
+        "ATMode": data[1] == 1,
+        "Sound": data[2] == 1,
+        "AddMode": data[3] == 1,
+        "AutoPrintOn": data[4] == 1
+    }
+
+@tracing.traced("parse_detection_mode")
+def parse_detection_mode(data):
+    # 解析偵測模式 / GET_DETECTION_MODE response
+    if len(data) < 7:
+        print("[PARSE] GET_DETECTION_MODE data too short:", data)
+        return None
+    return {
+        "CountModeLv": data[0],
+        "SortOn": data[1] == 1,
+        "FaceOn": data[2] == 1,
+        "OrntOn": data[3] == 1,
+        "EmissionOn": data[4] == 1,
+        "FitMode": data[5],             # 0=OFF,1=ATM,2=FIT,3=UNFIT,4=TAPE
+        "SerialMode": data[6]           # 0=OFF,1=ON,2=Compare,3=TITO,4=Check
+    }
+
+@tracing.traced("parse_setup_result")
+def parse_setup_result(data):
+    # 解析 SETUP 結果, 0 為成功 / SETUP result byte, 0 means success
+    if len(data) < 1:
+        print("[PARSE] SETUP result data too short:", data)
+        return None
+    return {"Success": data[0] == 0, "Code": data[0]}
+
+@tracing.traced("parse_config_read")
+def parse_config_read(data):
+    # ConfigData 為類別層級狀態 / ConfigData is class-level state shared by threads
+    with _config_lock:
+        ConfigData.from_bytes(data)
+        return ConfigData.to_dict()
+
+@tracing.traced("parse_date_time")
+def parse_date_time(data):
+    return data.decode('utf-8')
+
+def parse_banknote_data(data):
+    return format_to_new_json_structure(parse_custom_data(data))
+
+# 回應命令碼 -> 解析函式 / RESPONSE command code -> decoder
+RESPONSE_DECODERS = {
+    SocketCommand.SOCKET_RESPONSE_CMD_BANKNOTE_DATA: parse_banknote_data,
+    SocketCommand.SOCKET_RESPONSE_CMD_ASK_STATUS: parse_machine_status,
+    SocketCommand.SOCKET_RESPONSE_CMD_CONFIG_READ: parse_config_read,
+    SocketCommand.SOCKET_RESPONSE_CMD_ASK_DATE_TIME: parse_date_time,
+    SocketCommand.SOCKET_ACTION_GET_VARUIOS_MARAMETERS: parse_various_parameters,
+    SocketCommand.SOCKET_ACTION_CMD_GET_DETECTION_MODE: parse_detection_mode,
+    SocketCommand.SOCKET_SETUP_CMD_SELECT_CURRENCY: parse_setup_result,
+    SocketCommand.SOCKET_SETUP_CMD_SET_CURRENCY_MODE: parse_setup_result,
+    SocketCommand.SOCKET_SETUP_CMD_SET_DETECTION_MODE: parse_setup_result,
+}
+
+def decode_response(cmd, data):
+    # 將回應資料轉為結果 / Decode a RESPONSE payload into a value, None if it carries no data
+    decoder = RESPONSE_DECODERS.get(cmd)
+    if decoder is None:
+        return None
+    return decoder(data)
+
 def parse_command(rawData, sock):
+    # 依命令碼追蹤 / Traced per machine and command code
+    if not tracing.is_enabled():
+        return _parse_command(rawData, sock)
+    cmd = rawData[2] if len(rawData) > 2 else None
+    with tracing.span("parse_command", sock, cmd):
+        return _parse_command(rawData, sock)
+
+def _parse_command(rawData, sock):
     try:
         if is_bcc_valid(rawData):
             print("[PARSE] Valid BCC. Responding ACK.")
@@ -205,66 +297,46 @@ def parse_command(rawData, sock):
             print(f"[CMD] Received CMD: 0x{cmd:02X}, FORMAT: 0x{cmd_format:02X}")
             if cmd_format == SocketCommandType.RESPONSE_CMD_FORMAT:
                 data = rawData[9:-2]
-                if cmd == SocketCommand.SOCKET_ACTION_GET_VARUIOS_MARAMETERS:
-                    if len(data) < 5:
-                        print("[PARSE] GET_VARUIOS_MARAMETERS data too short:", data)
-                    else:
-                        motor_speed = data[0]
-                        at_mode = data[1] == 1
-                        sound = data[2] == 1
-                        add_on = data[3] == 1
-                        auto_print_on = data[4] == 1
-
-                        print("[PARSE] GET_VARUIOS_MARAMETERS response:")
-                        print(f"  MotorSpeed     : {motor_speed} (0 = LOW, 1 = MEDIUM, 2 = HIGH, 3 = ULTRA)")
-                        print(f"  AT Mode        : {at_mode}")
-                        print(f"  Sound          : {sound}")
-                        print(f"  AddMode        : {add_on}")
-                        print(f"  AutoPrintOn    : {auto_print_on}")
-
-                if cmd == SocketCommand.SOCKET_ACTION_CMD_GET_DETECTION_MODE:
-                    if len(data) < 7:
-                        print("[PARSE] GET_DETECTION_MODE data too short:", data)
-                    else:
-                        count_lv = data[0]
-                        sort_on = (data[1] == 1)
-                        face_on = (data[2] == 1)
-                        ornt_on = (data[3] == 1)
-                        emission_on = (data[4] == 1)
-                        fit_mode = data[5]
-                        serial_mode = data[6]
-
-                        print("[PARSE] GET_DETECTION_MODE response:")
-                        print(f"  CountModeLv   : {count_lv}")
-                        print(f"  SortOn        : {sort_on}")
-                        print(f"  FaceOn        : {face_on}")
-                        print(f"  OrntOn        : {ornt_on}")
-                        print(f"  EmissionOn    : {emission_on}")
-                        print(f"  FitMode       : {fit_mode} (0=OFF,1=ATM,2=FIT,3=UNFIT,4=TAPE)")
-                        print(f"  SerialMode    : {serial_mode} (0=OFF,1=ON,2=Compare,3=TITO,4=Check)")
-                        
-                if cmd == SocketCommand.SOCKET_SETUP_CMD_SELECT_CURRENCY:
-                    print("[PARSE] SOCKET_SETUP_CMD_SELECT_CURRENCY success:",data[0]==0)
-
-                if cmd == SocketCommand.SOCKET_SETUP_CMD_SET_CURRENCY_MODE:
-                    print("[PARSE] SOCKET_SETUP_CMD_SET_CURRENCY_MODE success:",data[0]==0)
-
-                if cmd == SocketCommand.SOCKET_SETUP_CMD_SET_DETECTION_MODE:
-                    print("[PARSE] SOCKET_SETUP_CMD_SET_DETECTION_MODE success:",data[0]==0)
+                value = decode_response(cmd, data)
+                if cmd == SocketCommand.SOCKET_ACTION_GET_VARUIOS_MARAMETERS and value is not None:
+                    print("[PARSE] GET_VARUIOS_MARAMETERS response:")
+                    print(f"  MotorSpeed     : {value['MotorSpeed']} (0 = LOW, 1 = MEDIUM, 2 = HIGH, 3 = ULTRA)")
+                    print(f"  AT Mode        : {value['ATMode']}")
+                    print(f"  Sound          : {value['Sound']}")
+                    print(f"  AddMode        : {value['AddMode']}")
+                    print(f"  AutoPrintOn    : {value['AutoPrintOn']}")
+
+                if cmd == SocketCommand.SOCKET_ACTION_CMD_GET_DETECTION_MODE and value is not None:
+                    print("[PARSE] GET_DETECTION_MODE response:")
+                    print(f"  CountModeLv   : {value['CountModeLv']}")
+                    print(f"  SortOn        : {value['SortOn']}")
+                    print(f"  FaceOn        : {value['FaceOn']}")
+                    print(f"  OrntOn        : {value['OrntOn']}")
+                    print(f"  EmissionOn    : {value['EmissionOn']}")
+                    print(f"  FitMode       : {value['FitMode']} (0=OFF,1=ATM,2=FIT,3=UNFIT,4=TAPE)")
+                    print(f"  SerialMode    : {value['SerialMode']} (0=OFF,1=ON,2=Compare,3=TITO,4=Check)")
+
+                if cmd == SocketCommand.SOCKET_SETUP_CMD_SELECT_CURRENCY and value is not None:
+                    print("[PARSE] SOCKET_SETUP_CMD_SELECT_CURRENCY success:", value["Success"])
+
+                if cmd == SocketCommand.SOCKET_SETUP_CMD_SET_CURRENCY_MODE and value is not None:
+                    print("[PARSE] SOCKET_SETUP_CMD_SET_CURRENCY_MODE success:", value["Success"])
+
+                if cmd == SocketCommand.SOCKET_SETUP_CMD_SET_DETECTION_MODE and value is not None:
+                    print("[PARSE] SOCKET_SETUP_CMD_SET_DETECTION_MODE success:", value["Success"])
 
                 if cmd == SocketCommand.SOCKET_RESPONSE_CMD_BANKNOTE_DATA:
-                    parsed = parse_custom_data(data)
-                    final_json = format_to_new_json_structure(parsed)
-                    print("[PARSE] Parsed SOCKET_RESPONSE_CMD_BANKNOTE_DATA final_json JSON:\n", json.dumps(final_json, indent=2))
+                    print("[PARSE] Parsed SOCKET_RESPONSE_CMD_BANKNOTE_DATA final_json JSON:\n", json.dumps(value, indent=2))
+                    default_aggregator.add(value)
                 if cmd == SocketCommand.SOCKET_RESPONSE_CMD_ASK_STATUS:
-                    final_json = parse_machine_status(data)
-                    print("[PARSE] Parsed SOCKET_RESPONSE_CMD_ASK_STATUS final_json JSON:\n", json.dumps(final_json, indent=2))
+                    print("[PARSE] Parsed SOCKET_RESPONSE_CMD_ASK_STATUS final_json JSON:\n", json.dumps(value, indent=2))
+                    status_cache.deliver(sock, cmd, value)
                 if cmd == SocketCommand.SOCKET_RESPONSE_CMD_CONFIG_READ:
-                    ConfigData.from_bytes(data)
-                    print(ConfigData.to_dict())
+                    print(value)
+                    status_cache.deliver(sock, cmd, value)
                 if cmd == SocketCommand.SOCKET_RESPONSE_CMD_ASK_DATE_TIME:
-                    datetime_str = data.decode('utf-8')
-                    print(datetime_str)
+                    print(value)
+                    status_cache.deliver(sock, cmd, value)
                 if cmd == SocketCommand.SOCKET_ACTION_CMD_HEARTBEAT:
                     print("[CMD]Get heart beat")
             else:
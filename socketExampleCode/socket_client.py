@@ -7,14 +7,17 @@ import os
 import threading
 import select
 import time
+import json
 from datetime import datetime
-from packet_builder import build_packet, build_action,build_setup,build_multi, ACK, SEGMENT_SIZE, SocketCommand, SocketCommandType
+from packet_builder import build_packet, build_frame,build_multi, ACK, SEGMENT_SIZE, SocketCommand, ACTION_FRAMES, get_full_packet_length, DEFAULT_DETECTION_MODE, DEFAULT_VARIOUS_PARAMETERS
 from packet_parser import parse_command
 from data.config_data import ConfigData
+import status_cache
+import tracing
 
 
 ack_event = threading.Event()  # 用於等待 ACK 回應
-send_lock = threading.Lock()   # 防止同時送出封包
+send_lock = tracing.TracedLock("send_lock")   # 防止同時送出封包
 updating_event = threading.Event()
 
 def socket_listener(sock):
@@ -32,86 +35,47 @@ def socket_listener(sock):
                 print(f"[INFO] Received {len(data)} bytes")
                 buffer.extend(data)
 
-                offset = 0
-                while offset < len(buffer):
-                    remaining = len(buffer) - offset
-                    expected_len = get_full_packet_length(buffer, offset, remaining)
-                    if expected_len == -1 or remaining < expected_len:
-                        break
+                with tracing.span("socket_listener.frame", sock):
+                    offset = 0
+                    while offset < len(buffer):
+                        remaining = len(buffer) - offset
+                        expected_len = get_full_packet_length(buffer, offset, remaining)
+                        if expected_len == -1 or remaining < expected_len:
+                            break
 
-                    packet = buffer[offset:offset + expected_len]
+                        packet = buffer[offset:offset + expected_len]
 
-                    if len(packet) == 1 and packet[0] == ACK:
-                        ack_event.set()
-                        print("[PARSE] ACK received")
-                    else:
-                        parse_command(packet, sock)
+                        if len(packet) == 1 and packet[0] == ACK:
+                            ack_event.set()
+                            print("[PARSE] ACK received")
+                        else:
+                            parse_command(packet, sock)
 
-                    offset += expected_len
+                        offset += expected_len
 
-                if offset < len(buffer):
-                    buffer = buffer[offset:]  # 保留未處理的
-                else:
-                    buffer = bytearray()
+                    if offset < len(buffer):
+                        buffer = buffer[offset:]  # 保留未處理的
+                    else:
+                        buffer = bytearray()
 
         except Exception as e:
             print(f"[SOCKET IN] Error: {e}")
             break
 
 
-def get_full_packet_length(data: bytes, offset: int, available: int) -> int:
-    if available == 1 and data[offset] == ACK:
-        return 1
-
-    if available < 5:
-        return -1
-    if data[offset] != 0x02:
-        return -1
-
-    md = data[offset + 3]
-
-    if md == SocketCommandType.ACTION_CMD_FORMAT:
-        return 6
-
-    elif md == SocketCommandType.SETUP_CMD_FORMAT:
-        if available >= 6:
-            length = data[offset + 4]
-            return 7 + length
-
-    elif md == SocketCommandType.MULTI_PURPOSE_CMD_FORMAT:
-        if available >= 8:
-            length = (
-                data[offset + 4]
-                | (data[offset + 5] << 8)
-                | (data[offset + 6] << 16)
-                | (data[offset + 7] << 24)
-            )
-            return 8 + length + 3
-
-    elif md == SocketCommandType.RESPONSE_CMD_FORMAT:
-        if available >= 8:
-            length = (
-                data[offset + 4]
-                | (data[offset + 5] << 8)
-                | (data[offset + 6] << 16)
-                | (data[offset + 7] << 24)
-            )
-            return 8 + length + 3
-
-    return -1
-
-
 def heartbeat_sender(sock):
     # 定時送出心跳封包 / Send heartbeat every 10 seconds
     while True:
         try:
             if not updating_event.is_set():
-                packet = build_action(SocketCommand.SOCKET_ACTION_CMD_HEARTBEAT)
-                ack_event.clear()
-                with send_lock:
-                    sock.sendall(packet)
-                    print(f"[HEARTBEAT] Sent 0x{SocketCommand.SOCKET_ACTION_CMD_HEARTBEAT:02X} (heartbeat)")
-                if not ack_event.wait(timeout=30):
+                with tracing.span("heartbeat", sock, SocketCommand.SOCKET_ACTION_CMD_HEARTBEAT):
+                    packet = ACTION_FRAMES[SocketCommand.SOCKET_ACTION_CMD_HEARTBEAT]
+                    ack_event.clear()
+                    with send_lock:
+                        sock.sendall(packet)
+                        print(f"[HEARTBEAT] Sent 0x{SocketCommand.SOCKET_ACTION_CMD_HEARTBEAT:02X} (heartbeat)")
+                    acked = wait_ack()
+                if not acked:
                     print("[HEARTBEAT] Timeout waiting for ACK.")
                     break
                 else:
@@ -127,17 +91,18 @@ def upgrade_apk(filepath, sock):
     total_segments = (filesize + SEGMENT_SIZE - 1) // SEGMENT_SIZE
     with open(filepath, "rb") as f:
         for segment_id in range(total_segments):
-            chunk = f.read(SEGMENT_SIZE)
-            packet = build_packet(segment_id, SocketCommand.SOCKET_MULTI_CMD_UPGRADE_APK, total_segments, chunk)
-            ack_event.clear()
-            with send_lock:
-                sock.sendall(packet)
-                print(f"[upgrade_apk] Sent segment {segment_id + 1}/{total_segments}")
-            if not ack_event.wait(timeout=30):
-                print("[upgrade_apk] Timeout waiting for ACK. Aborting.")
-                return
-            else:
-                print("[upgrade_apk] Got ACK")
+            with tracing.span("upgrade_apk.segment", sock, SocketCommand.SOCKET_MULTI_CMD_UPGRADE_APK):
+                chunk = f.read(SEGMENT_SIZE)
+                packet = build_packet(segment_id, SocketCommand.SOCKET_MULTI_CMD_UPGRADE_APK, total_segments, chunk)
+                ack_event.clear()
+                with send_lock:
+                    sock.sendall(packet)
+                    print(f"[upgrade_apk] Sent segment {segment_id + 1}/{total_segments}")
+                if not wait_ack():
+                    print("[upgrade_apk] Timeout waiting for ACK. Aborting.")
+                    return
+                else:
+                    print("[upgrade_apk] Got ACK")
     print("[upgrade_apk] Upload complete.")
 
 def upgrade_sdc(filepath, sock):
@@ -146,39 +111,63 @@ def upgrade_sdc(filepath, sock):
     total_segments = (filesize + SEGMENT_SIZE - 1) // SEGMENT_SIZE
     with open(filepath, "rb") as f:
         for segment_id in range(total_segments):
-            chunk = f.read(SEGMENT_SIZE)
-            packet = build_packet(segment_id, SocketCommand.SOCKET_MULTI_CMD_UPGRADE_SDC, total_segments, chunk)
-            ack_event.clear()
-            with send_lock:
-                sock.sendall(packet)
-                print(f"[upgrade_sdc] Sent segment {segment_id + 1}/{total_segments}")
-            if not ack_event.wait(timeout=30):
-                print("[upgrade_sdc] Timeout waiting for ACK. Aborting.")
-                return
-            else:
-                print("[upgrade_sdc] Got ACK")
+            with tracing.span("upgrade_sdc.segment", sock, SocketCommand.SOCKET_MULTI_CMD_UPGRADE_SDC):
+                chunk = f.read(SEGMENT_SIZE)
+                packet = build_packet(segment_id, SocketCommand.SOCKET_MULTI_CMD_UPGRADE_SDC, total_segments, chunk)
+                ack_event.clear()
+                with send_lock:
+                    sock.sendall(packet)
+                    print(f"[upgrade_sdc] Sent segment {segment_id + 1}/{total_segments}")
+                if not wait_ack():
+                    print("[upgrade_sdc] Timeout waiting for ACK. Aborting.")
+                    return
+                else:
+                    print("[upgrade_sdc] Got ACK")
     print("[upgrade_sdc] Upload complete.")
 
 
 
+def wait_ack(timeout=30):
+    # 等待設備 ACK / Wait for the device ACK, traced as its own span
+    with tracing.span("ack_wait"):
+        return ack_event.wait(timeout=timeout)
+
 def send_socket_data(sock, packet):
-    try:
-        ack_event.clear()
-        with send_lock:
-            sock.sendall(packet)
-            print(f"[STATUS] Sent 0x{SocketCommand.SOCKET_ACTION_CMD_ASK_STATUS:02X} (status)")
-        if not ack_event.wait(timeout=30):
-            print("[STATUS] Timeout waiting for ACK.")
-        else:
+    # 回傳是否收到 ACK / Returns True once the device ACKed the packet
+    with tracing.span("send_socket_data", sock, packet[2]):
+        try:
+            ack_event.clear()
+            with send_lock:
+                sock.sendall(packet)
+                status_cache.note_sent(sock, packet)
+                print(f"[STATUS] Sent 0x{SocketCommand.SOCKET_ACTION_CMD_ASK_STATUS:02X} (status)")
+            if not wait_ack():
+                print("[STATUS] Timeout waiting for ACK.")
+                return False
             print("[STATUS] Got ACK")
-    except Exception as e:
-        print(f"[STATUS] Error: {e}")
+            return True
+        except Exception as e:
+            print(f"[STATUS] Error: {e}")
+            return False
+
+def query_cached(sock, cmd):
+    # 透過快取查詢 / Query through the machine's response cache
+    packet = build_frame(cmd)
+    cache = status_cache.get_cache(sock)
+    if cache is None:
+        send_socket_data(sock, packet)
+        return None
+    result = cache.get(cmd, lambda: send_socket_data(sock, packet))
+    print(f"[CACHE] 0x{cmd:02X} {cache.stats()}")
+    print(json.dumps(result, indent=2) if isinstance(result, dict) else result)
+    return result
 
 def main_loop(host, port):
     # 主連線流程 / Main client loop
     with socket.create_connection((host, port)) as s:
         s.settimeout(30)
         print(f"Connected to {host}:{port}")
+        status_cache.register(s, status_cache.StatusCache())
         threading.Thread(target=socket_listener, args=(s,), daemon=True).start()
         threading.Thread(target=heartbeat_sender, args=(s,), daemon=True).start()
 
@@ -190,47 +179,34 @@ def main_loop(host, port):
                 user_input = input("> ").strip()
 
                 if user_input == "a1":
-                    packet = build_action(SocketCommand.SOCKET_ACTION_CMD_START_KEY)
+                    packet = ACTION_FRAMES[SocketCommand.SOCKET_ACTION_CMD_START_KEY]
                     send_socket_data(s, packet)
                 elif user_input == "a2":
-                    packet = build_action(SocketCommand.SOCKET_ACTION_CMD_CLEAR_KEY)
+                    packet = ACTION_FRAMES[SocketCommand.SOCKET_ACTION_CMD_CLEAR_KEY]
                     send_socket_data(s, packet)
                 elif user_input == "a3":
-                    packet = build_action(SocketCommand.SOCKET_ACTION_CMD_GET_DETECTION_MODE)
+                    packet = ACTION_FRAMES[SocketCommand.SOCKET_ACTION_CMD_GET_DETECTION_MODE]
                     send_socket_data(s, packet)
                 elif user_input == "a4":
-                    packet = build_action(SocketCommand.SOCKET_ACTION_GET_VARUIOS_MARAMETERS)
+                    packet = ACTION_FRAMES[SocketCommand.SOCKET_ACTION_GET_VARUIOS_MARAMETERS]
                     send_socket_data(s, packet)
                 elif user_input == "s10":
-                    packet = build_setup(SocketCommand.SOCKET_SETUP_CMD_SELECT_CURRENCY, [0x00])
+                    packet = build_frame(SocketCommand.SOCKET_SETUP_CMD_SELECT_CURRENCY, [0x00])
                     send_socket_data(s, packet)
                 elif user_input == "s11":
-                    packet = build_setup(SocketCommand.SOCKET_SETUP_CMD_SET_CURRENCY_MODE, [0x01])
+                    packet = build_frame(SocketCommand.SOCKET_SETUP_CMD_SET_CURRENCY_MODE, [0x01])
                     send_socket_data(s, packet)
                 elif user_input == "s12":
-                    params = [
-                            0x01,  # SortOn: enable sorting
-                            0x00,  # FaceOn: disable face detection
-                            0x00,  # OrntOn: disable orientation check
-                            0x01,  # EmissionOn: enable UV/IR emission
-                            0x00,  # FitMode: COMPASS_FIT_OFF (0) 0 FIT Disable, 1 ATM, 2 FIT, 3 UNFIT, 4 TAPE
-                            0x01  # SerialMode: COMPASS_SN_OFF (0)  0 Serial Disable, 1 Serial Enable, 2 Serial Compare, 3 TITO Enable, 4 CHECK Enable
-                        ]
-                    packet = build_setup(SocketCommand.SOCKET_SETUP_CMD_SET_DETECTION_MODE,params)
+                    packet = build_frame(SocketCommand.SOCKET_SETUP_CMD_SET_DETECTION_MODE, DEFAULT_DETECTION_MODE)
                     send_socket_data(s, packet)
                 elif user_input == "s13":
-                    params = [   
-                            0x01,  # MotorSpeed: (0 = LOW, 1 = MEDIUM, 2 = HIGH, 3 = ULTRA)
-                            0x01,  # SoundOn: ON
-                            0x00   # AutoPrintOn: OFF
-                        ]
-                    packet = build_setup(SocketCommand.SOCKET_SETUP_SET_VARUIOS_MARAMETERS, params)
+                    packet = build_frame(SocketCommand.SOCKET_SETUP_SET_VARUIOS_MARAMETERS, DEFAULT_VARIOUS_PARAMETERS)
                     send_socket_data(s, packet)
                 elif user_input == "s14":
-                    packet = build_setup(SocketCommand.SOCKET_SETUP_SET_ADD_MODE, [0x01])
+                    packet = build_frame(SocketCommand.SOCKET_SETUP_SET_ADD_MODE, [0x01])
                     send_socket_data(s, packet)
                 elif user_input == "s15":
-                    packet = build_setup(SocketCommand.SOCKET_SETUP_SET_AT_MT_MODE, [0x01])
+                    packet = build_frame(SocketCommand.SOCKET_SETUP_SET_AT_MT_MODE, [0x01])
                     send_socket_data(s, packet)
                 elif user_input == "1":
                     updating_event.set()
@@ -241,8 +217,7 @@ def main_loop(host, port):
                     upgrade_sdc("NC7500.sd6", s)
                     updating_event.clear()
                 elif user_input == "3":
-                    packet = build_action(SocketCommand.SOCKET_ACTION_CMD_ASK_STATUS)
-                    send_socket_data(s, packet)
+                    query_cached(s, SocketCommand.SOCKET_ACTION_CMD_ASK_STATUS)
                 elif user_input == "4":
                     ConfigData.MaxNotes = 100
                     ConfigData.ftpusername = "user"
@@ -264,22 +239,20 @@ def main_loop(host, port):
 
                     
                 elif user_input == "5":
-                    packet = build_action(SocketCommand.SOCKET_ACTION_CMD_CONFIG_READ)
-                    send_socket_data(s, packet)
+                    query_cached(s, SocketCommand.SOCKET_ACTION_CMD_CONFIG_READ)
                     
                 elif user_input == "6":
                     data=[1]
-                    packet = build_setup(SocketCommand.SOCKET_SETUP_CMD_AUDIT_MODE, data)
+                    packet = build_frame(SocketCommand.SOCKET_SETUP_CMD_AUDIT_MODE, data)
                     send_socket_data(s, packet)
                     
                 elif user_input == "7":
                     data=[0]
-                    packet = build_setup(SocketCommand.SOCKET_SETUP_CMD_AUDIT_MODE, data)
+                    packet = build_frame(SocketCommand.SOCKET_SETUP_CMD_AUDIT_MODE, data)
                     send_socket_data(s, packet)
                     
                 elif user_input == "8":
-                    packet = build_action(SocketCommand.SOCKET_ACTION_CMD_ASK_DATE_TIME)
-                    send_socket_data(s, packet)
+                    query_cached(s, SocketCommand.SOCKET_ACTION_CMD_ASK_DATE_TIME)
 
                 elif user_input == "9":
                     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -289,6 +262,7 @@ def main_loop(host, port):
                     
                 elif user_input.lower() == "q":
                     print("Exiting...")
+                    status_cache.unregister(s)
                     break
                 else:
                     print("Unknown command.")
@@ -0,0 +1,179 @@
+# === status_cache.py ===
+# 查詢回應快取 / Per-machine response cache for polled query commands
+import threading
+import time
+from packet_builder import SocketCommand
+
+# 各查詢命令的快取秒數 / Cache TTL (seconds) per query command code
+DEFAULT_TTL = {
+    SocketCommand.SOCKET_ACTION_CMD_ASK_STATUS: 5.0,
+    SocketCommand.SOCKET_ACTION_CMD_CONFIG_READ: 60.0,
+    SocketCommand.SOCKET_ACTION_CMD_ASK_DATE_TIME: 1.0,
+}
+
+# 送出後使快取失效的寫入命令 / Write commands that invalidate cached answers
+WRITE_COMMANDS = {
+    SocketCommand.SOCKET_MULTI_CMD_CONFIG_WRITE,
+    SocketCommand.SOCKET_MULTI_CMD_SET_DATE_TIME,
+    SocketCommand.SOCKET_SETUP_CMD_AUDIT_MODE,
+}
+
+
+class _InFlight:
+    # 進行中的查詢 / One outstanding device query shared by all waiters
+    def __init__(self, generation):
+        self.event = threading.Event()
+        self.value = None
+        self.generation = generation
+
+
+class StatusCache:
+    """
+    Response cache for one machine, keyed by command code.
+
+    Fresh entries are answered locally. Concurrent misses for the same
+    command collapse onto a single device query: the first caller sends,
+    the others wait for the response delivered by the socket listener.
+    Event loops that cannot block use begin()/deliver()/abandon() instead
+    of get().
+    """
+
+    def __init__(self, ttl=None, timeout=30):
+        # ttl: {命令: 秒數} 覆寫, 或單一秒數套用全部; 0 為不快取
+        # ttl: {cmd: seconds} overrides, or one number for every command; 0 disables caching
+        self.ttl = dict(DEFAULT_TTL)
+        if isinstance(ttl, dict):
+            self.ttl.update(ttl)
+        elif ttl is not None:
+            self.ttl = dict.fromkeys(DEFAULT_TTL, ttl)
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+        self._entries = {}    # cmd -> (expires_at, value)
+        self._inflight = {}   # cmd -> _InFlight
+        self._generation = 0  # 每次寫入遞增 / bumped on every write command
+        self._lock = threading.Lock()
+
+    def _begin(self, cmd):
+        # 回傳 ("hit", 值) / ("wait", flight) / ("send", flight)
+        with self._lock:
+            entry = self._entries.get(cmd)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return "hit", entry[1]
+            flight = self._inflight.get(cmd)
+            if flight is not None:
+                self.collapsed += 1
+                return "wait", flight
+            self.misses += 1
+            flight = _InFlight(self._generation)
+            self._inflight[cmd] = flight
+            return "send", flight
+
+    def begin(self, cmd):
+        # 非阻塞查詢, 供事件迴圈使用 / Non-blocking variant of get() for event loops
+        # "send" 的呼叫者之後必須 deliver() 或 abandon() / a "send" caller must later deliver() or abandon()
+        state, value = self._begin(cmd)
+        return state, (value if state == "hit" else None)
+
+    def get(self, cmd, send):
+        # 取得快取或查詢設備 / Return cached value or query the device via send()
+        # send() 回傳 False 表示送出失敗 / send() returning False means the query was not sent
+        state, flight = self._begin(cmd)
+        if state == "hit":
+            return flight
+
+        if state == "send":
+            try:
+                sent = send()
+            except Exception:
+                self._abandon(cmd, flight)
+                raise
+            if sent is False:
+                self._abandon(cmd, flight)
+                return None
+
+        if not flight.event.wait(timeout=self.timeout):
+            print(f"[CACHE] Timeout waiting for response 0x{cmd:02X}")
+            self._abandon(cmd, flight)
+            return None
+        return flight.value
+
+    def deliver(self, cmd, value):
+        # 由監聽執行緒交付回應 / Called by the listener when a response is parsed
+        with self._lock:
+            flight = self._inflight.pop(cmd, None)
+            # 查詢期間發生寫入則不快取, 解析失敗 (None) 也不快取
+            # skip caching if a write raced the query or parsing failed (None)
+            if value is not None and (flight is None or flight.generation == self._generation):
+                ttl = self.ttl.get(cmd, 0)
+                if ttl > 0:
+                    self._entries[cmd] = (time.monotonic() + ttl, value)
+        if flight is not None:
+            flight.value = value
+            flight.event.set()
+
+    def abandon(self, cmd):
+        # 放棄進行中的查詢, 等待者收到 None / Give up an in-flight query; waiters get None
+        with self._lock:
+            flight = self._inflight.pop(cmd, None)
+        if flight is not None:
+            flight.event.set()
+
+    def invalidate(self):
+        # 清除所有快取 / Drop every cached answer
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "collapsed": self.collapsed,
+                "entries": len(self._entries),
+            }
+
+    def _abandon(self, cmd, flight):
+        with self._lock:
+            if self._inflight.get(cmd) is flight:
+                del self._inflight[cmd]
+        flight.event.set()
+
+
+# 每個連線一個快取 / One cache per machine connection
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def register(sock, cache):
+    with _caches_lock:
+        _caches[sock] = cache
+
+
+def unregister(sock):
+    with _caches_lock:
+        _caches.pop(sock, None)
+
+
+def get_cache(sock):
+    with _caches_lock:
+        return _caches.get(sock)
+
+
+def deliver(sock, cmd, value):
+    # 交付回應給對應機器的快取 / Route a parsed response to the machine's cache
+    cache = get_cache(sock)
+    if cache is not None:
+        cache.deliver(cmd, value)
+
+
+def note_sent(sock, packet):
+    # 寫入命令送出後失效 / Invalidate the machine's cache after a write command
+    if len(packet) < 3 or packet[2] not in WRITE_COMMANDS:
+        return
+    cache = get_cache(sock)
+    if cache is not None:
+        cache.invalidate()
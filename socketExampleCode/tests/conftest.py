@@ -0,0 +1,5 @@
+# 讓測試以平面模組方式匯入 / Make the flat modules importable from tests
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,83 @@
+import pytest
+
+from cash_aggregator import CashAggregator, merge_snapshots
+from device_simulator import build_count_payload
+from packet_builder import SocketCommand
+from packet_parser import decode_response
+
+
+def count_file(number, machine="M1", cashier="C1", start="2026-03-01 23:30:00", notes=()):
+    details = [{"currency": c, "nominal": n, "issue": "", "sn": "", "noteError": e, "rejected": r}
+               for c, n, e, r in notes]
+    return {
+        "CountSettings": {"CashierId": cashier, "NumberCountFile": number},
+        "CountResult": {"MachineSerialNumber": machine, "StartTime": start, "Notes": details},
+    }
+
+
+NOTES = [("RUB", 100, 0, False), ("RUB", 500, 0, False), ("", 0, 7, True), ("USD", 20, 3, True)]
+
+
+def test_add_totals_and_reject_rate():
+    agg = CashAggregator()
+    assert agg.add(count_file(1, notes=NOTES))
+    snap = agg.snapshot()
+    assert snap["Totals"]["TotalNotes"] == 4
+    assert snap["Totals"]["RejectNotes"] == 2
+    assert snap["Totals"]["RejectRate"] == 0.5
+    assert snap["Totals"]["TotalAmount"] == [{"Currency": "RUB", "Amount": 600}]
+    assert snap["ByCurrency"]["RUB"]["ByNominal"] == {100: 1, 500: 1}
+    assert snap["NoteErrors"] == {7: 1, 3: 1}
+
+
+def test_resend_is_counted_once():
+    agg = CashAggregator()
+    assert agg.add(count_file(5, notes=NOTES))
+    assert not agg.add(count_file(5, notes=NOTES))
+    assert agg.add(count_file(5, machine="M2", notes=NOTES))
+    snap = agg.snapshot()
+    assert snap["Files"] == 2 and snap["Duplicates"] == 1
+    assert snap["ByMachine"]["M1"]["TotalNotes"] == 4
+
+
+def test_dedup_window_is_bounded():
+    agg = CashAggregator(dedup_window=2)
+    for number in (1, 2, 3):
+        assert agg.add(count_file(number))
+    assert not agg.add(count_file(2))    # still inside the window
+    assert agg.add(count_file(1))        # evicted from the window
+    assert not agg.add(count_file(1))
+    assert agg.add(count_file(2))        # evicted by the re-added 1
+    snap = agg.snapshot()
+    assert snap["Files"] == 5 and snap["Duplicates"] == 2
+
+
+def test_bucket_seconds_must_be_positive():
+    with pytest.raises(ValueError):
+        CashAggregator(bucket_seconds=0)
+
+
+def test_day_bucket_uses_local_time():
+    agg = CashAggregator(bucket_seconds=86400)
+    agg.add(count_file(1, start="2026-03-01 23:30:00"))
+    agg.add(count_file(2, start="2026-03-01 00:10:00"))
+    assert list(agg.snapshot()["ByTimeBucket"]) == ["2026-03-01 00:00:00"]
+    hourly = CashAggregator()
+    hourly.add(count_file(1, start="2026-03-01 23:30:00"))
+    assert list(hourly.snapshot()["ByTimeBucket"]) == ["2026-03-01 23:00:00"]
+
+
+def test_merge_snapshots_matches_single_aggregator():
+    single, left, right = CashAggregator(), CashAggregator(), CashAggregator()
+    for number, machine in ((1, "M1"), (2, "M2"), (3, "M1")):
+        single.add(count_file(number, machine=machine, notes=NOTES))
+        (left if machine == "M1" else right).add(count_file(number, machine=machine, notes=NOTES))
+    assert merge_snapshots([left.snapshot(), right.snapshot()]) == single.snapshot()
+
+
+def test_decoded_count_file_feeds_aggregator():
+    payload = build_count_payload("SIM01", 9, [("RUB", 1000, 0, False), ("", 0, 2, True)])
+    count = decode_response(SocketCommand.SOCKET_RESPONSE_CMD_BANKNOTE_DATA, payload)
+    agg = CashAggregator()
+    assert agg.add(count)
+    assert agg.snapshot()["ByMachine"]["SIM01"]["RejectRate"] == 0.5
@@ -0,0 +1,86 @@
+import socket
+import time
+
+import pytest
+
+from device_simulator import start_simulators
+from fleet_runner import FleetRunner, machine_key, shard_for
+from packet_builder import SocketCommand
+
+STATUS = SocketCommand.SOCKET_ACTION_CMD_ASK_STATUS
+DETECTION = SocketCommand.SOCKET_ACTION_CMD_GET_DETECTION_MODE
+AUDIT = SocketCommand.SOCKET_SETUP_CMD_AUDIT_MODE
+
+
+@pytest.fixture(scope="module")
+def device():
+    (host, port, serial), = start_simulators(1, delay=0.05)
+    return host, port, serial
+
+
+@pytest.fixture(scope="module")
+def fleet():
+    return start_simulators(6)
+
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_shard_for_is_stable():
+    keys = [machine_key("10.0.0.%d" % i, 5888) for i in range(50)]
+    shards = [shard_for(key, 4) for key in keys]
+    assert shards == [shard_for(key, 4) for key in keys]
+    assert set(shards) == {0, 1, 2, 3}
+    assert shard_for("SIM0000001", 4) == 0     # crc32, not hash(): same in every process
+    assert machine_key("h", 1, "SN1") == "SN1"
+
+
+def test_results_in_submission_order_and_metrics_merge(fleet):
+    commands = [(host, port, STATUS, None, serial) for _ in range(3) for host, port, serial in fleet]
+    with FleetRunner(workers=2, timeout=5, cache_ttl=0) as runner:
+        results = runner.run(commands)
+        metrics = runner.metrics()
+    assert [r["machine"] for r in results] == [serial for _, _, _, _, serial in commands]
+    assert all(r["ok"] and r["value"]["MachineSerialNumber"] == r["machine"] for r in results)
+    assert len(metrics["per_shard"]) == 2
+    assert metrics["commands"] == len(commands) == sum(m["commands"] for m in metrics["per_shard"])
+    assert metrics["connects"] == len(fleet)
+    assert metrics["errors"] == 0
+
+
+def test_unreachable_device_fails_fast_in_backoff():
+    port = closed_port()
+    with FleetRunner(workers=1, timeout=5, cache_ttl=0) as runner:
+        results = runner.run([("127.0.0.1", port, STATUS)] * 3)
+        start = time.monotonic()
+        again = runner.run([("127.0.0.1", port, STATUS)] * 2)
+        elapsed = time.monotonic() - start
+        metrics = runner.metrics()
+    assert results[0]["error"].startswith("connect failed")
+    assert all(r["error"].startswith("backing off") for r in results[1:] + again)
+    assert elapsed < 0.5
+    assert metrics["connect_failures"] == 1
+    assert metrics["skipped"] == 4
+
+
+def test_read_queued_behind_write_is_not_cached(device):
+    host, port, _ = device
+    with FleetRunner(workers=1, timeout=5) as runner:
+        runner.run([(host, port, STATUS)])
+        results = runner.run([(host, port, DETECTION), (host, port, AUDIT, [1]), (host, port, STATUS)])
+        metrics = runner.metrics()
+    assert [r["ok"] for r in results] == [True, True, True]
+    assert metrics["cache_hits"] == 0
+    assert metrics["cache_misses"] == 1
+
+
+def test_cache_ttl_zero_sends_every_query(device):
+    host, port, _ = device
+    with FleetRunner(workers=1, timeout=5, cache_ttl=0) as runner:
+        results = runner.run([(host, port, STATUS)] * 3)
+        metrics = runner.metrics()
+    assert all(r["ok"] and r["value"] for r in results)
+    assert metrics["cache_hits"] + metrics["cache_misses"] + metrics["cache_collapsed"] == 0
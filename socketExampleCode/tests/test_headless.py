@@ -0,0 +1,60 @@
+import json
+import socket
+
+import pytest
+
+import headless
+from device_simulator import start_simulators
+
+
+@pytest.fixture(scope="module")
+def device():
+    (host, port, serial), = start_simulators(1)
+    return host, port, serial
+
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run(capsys, targets, commands, timeout=5):
+    code = headless.run(targets, commands, timeout)
+    return code, json.loads(capsys.readouterr().out)
+
+
+def test_ok_report(capsys, device):
+    host, port, serial = device
+    code, reports = run(capsys, [(host, port)], ["status", "date-time", "audit-on"])
+    assert code == headless.EXIT_OK
+    report, = reports
+    assert report["target"] == f"{host}:{port}" and report["ok"]
+    assert [r["command"] for r in report["results"]] == ["status", "date-time", "audit-on"]
+    assert report["results"][0]["value"]["MachineSerialNumber"] == serial
+    assert all(r["ok"] and "ms" in r for r in report["results"])
+
+
+def test_unknown_command_is_usage_error(capsys, device):
+    host, port, _ = device
+    assert headless.run([(host, port)], ["status", "bogus"]) == headless.EXIT_USAGE
+    assert "bogus" in capsys.readouterr().err
+
+
+def test_unreachable_target(capsys, device):
+    host, port, _ = device
+    code, reports = run(capsys, [(host, port), ("127.0.0.1", closed_port())], ["status"])
+    assert code == headless.EXIT_CONNECT_FAILED
+    assert reports[0]["ok"]
+    assert reports[1]["connected"] is False and reports[1]["error"].startswith("connect failed")
+
+
+def test_silent_device_fails_command(capsys):
+    # 接受連線但從不回應 / accepts the connection but never answers
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        code, reports = run(capsys, [listener.getsockname()], ["status", "date-time"], timeout=0.2)
+    assert code == headless.EXIT_COMMAND_FAILED
+    result, = reports[0]["results"]        # stops at the first failure
+    assert not result["ok"] and result["error"]
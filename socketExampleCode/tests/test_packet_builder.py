@@ -0,0 +1,41 @@
+from packet_builder import (
+    ACTION_FRAMES, SETUP_FRAMES, ACK, SocketCommand,
+    build_action, build_setup, build_frame, build_response, get_full_packet_length,
+)
+from packet_parser import decode_response, is_bcc_valid
+
+
+def test_action_frames_match_build_action():
+    for cmd, frame in ACTION_FRAMES.items():
+        assert frame == build_action(cmd)
+
+
+def test_setup_frames_match_build_setup():
+    for (cmd, params), frame in SETUP_FRAMES.items():
+        assert frame == build_setup(cmd, list(params))
+
+
+def test_build_frame_uses_table_and_falls_back():
+    status = SocketCommand.SOCKET_ACTION_CMD_ASK_STATUS
+    assert build_frame(status) is ACTION_FRAMES[status]
+    audit = SocketCommand.SOCKET_SETUP_CMD_AUDIT_MODE
+    assert build_frame(audit, [1]) is SETUP_FRAMES[(audit, (1,))]
+    assert build_frame(SocketCommand.SOCKET_SETUP_SET_ADD_MODE, [0x02]) == build_setup(SocketCommand.SOCKET_SETUP_SET_ADD_MODE, [0x02])
+
+
+def test_ack_coalesced_with_next_frame():
+    response = build_response(SocketCommand.SOCKET_RESPONSE_CMD_ASK_DATE_TIME, b"2026-01-01 00:00:00")
+    buffer = bytes([ACK]) + response
+    assert get_full_packet_length(buffer, 0, len(buffer)) == 1
+    assert get_full_packet_length(buffer, 1, len(buffer) - 1) == len(response)
+    assert is_bcc_valid(response)
+
+
+def test_decode_detection_mode_and_setup_result():
+    mode = decode_response(SocketCommand.SOCKET_ACTION_CMD_GET_DETECTION_MODE, bytes([2, 1, 0, 0, 1, 3, 1]))
+    assert mode == {"CountModeLv": 2, "SortOn": True, "FaceOn": False, "OrntOn": False,
+                    "EmissionOn": True, "FitMode": 3, "SerialMode": 1}
+    params = decode_response(SocketCommand.SOCKET_ACTION_GET_VARUIOS_MARAMETERS, bytes([3, 1, 0, 1, 0]))
+    assert params["MotorSpeed"] == 3 and params["ATMode"] and params["AddMode"]
+    result = decode_response(SocketCommand.SOCKET_SETUP_CMD_SELECT_CURRENCY, bytes([1]))
+    assert result == {"Success": False, "Code": 1}
@@ -0,0 +1,86 @@
+import threading
+import time
+
+from packet_builder import SocketCommand
+from status_cache import StatusCache
+
+STATUS = SocketCommand.SOCKET_ACTION_CMD_ASK_STATUS
+
+
+def test_concurrent_misses_send_once():
+    cache = StatusCache(timeout=2)
+    sent = []
+    results = []
+
+    def send():
+        sent.append(1)
+        # 模擬監聽執行緒稍後交付 / the listener delivers a little later
+        threading.Timer(0.05, cache.deliver, (STATUS, {"Ready": True})).start()
+        return True
+
+    threads = [threading.Thread(target=lambda: results.append(cache.get(STATUS, send))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(sent) == 1
+    assert results == [{"Ready": True}] * 8
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["collapsed"] == 7
+
+
+def test_hit_until_ttl_expires():
+    cache = StatusCache(ttl={STATUS: 0.05})
+    assert cache.begin(STATUS) == ("send", None)
+    cache.deliver(STATUS, {"Ready": True})
+    assert cache.begin(STATUS) == ("hit", {"Ready": True})
+    time.sleep(0.06)
+    assert cache.begin(STATUS) == ("send", None)
+
+
+def test_invalidate_and_write_racing_query():
+    cache = StatusCache()
+    cache.begin(STATUS)
+    cache.deliver(STATUS, {"Ready": True})
+    cache.invalidate()
+    assert cache.begin(STATUS)[0] == "send"
+    # 查詢期間發生寫入, 回應不得快取 / a write during the query must not be cached
+    cache.invalidate()
+    cache.deliver(STATUS, {"Ready": False})
+    assert cache.begin(STATUS)[0] == "send"
+
+
+def test_none_is_not_cached():
+    cache = StatusCache()
+    cache.begin(STATUS)
+    cache.deliver(STATUS, None)
+    assert cache.begin(STATUS)[0] == "send"
+    assert cache.stats()["entries"] == 0
+
+
+def test_failed_send_releases_waiters():
+    cache = StatusCache(timeout=5)
+    start = time.monotonic()
+    assert cache.get(STATUS, lambda: False) is None
+    assert time.monotonic() - start < 1
+    assert cache.begin(STATUS)[0] == "send"
+
+
+def test_abandon_wakes_waiters():
+    cache = StatusCache(timeout=5)
+    assert cache.begin(STATUS)[0] == "send"
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(cache.get(STATUS, lambda: True)))
+    waiter.start()
+    time.sleep(0.05)
+    cache.abandon(STATUS)
+    waiter.join(1)
+    assert results == [None]
+
+
+def test_ttl_zero_disables_caching():
+    cache = StatusCache(ttl=0)
+    assert cache.ttl[STATUS] == 0
+    cache.begin(STATUS)
+    cache.deliver(STATUS, {"Ready": True})
+    assert cache.begin(STATUS)[0] == "send"
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture(autouse=True)
+def clean_tracing():
+    tracing.clear()
+    yield
+    tracing.disable()
+    tracing.clear()
+
+
+def test_disabled_span_is_noop():
+    assert tracing.span("x", "127.0.0.1:1", 0x9B) is tracing._NOOP
+    with tracing.span("x"):
+        pass
+    assert not tracing._events
+
+
+def test_children_inherit_parent_tags():
+    tracing.enable()
+    with tracing.span("execute", "10.0.0.1:5888", 0x9B):
+        with tracing.span("parse", cmd=0x9E):
+            pass
+    child, parent = tracing._events
+    assert parent["args"] == {"machine": "10.0.0.1:5888", "cmd": "0x9B"}
+    assert child["args"] == {"machine": "10.0.0.1:5888", "cmd": "0x9E"}
+
+
+def test_unsampled_root_suppresses_children(monkeypatch):
+    tracing.enable(sample_rate=0.5)
+    monkeypatch.setattr(tracing.random, "random", lambda: 0.9)
+    with tracing.span("root") as root:
+        assert root is tracing._SUPPRESSED
+        assert tracing.span("child") is tracing._SUPPRESSED
+    assert tracing._local.depth == 0
+    assert not tracing._events
+    # 下一個根 span 重新抽樣 / the next root is sampled again
+    monkeypatch.setattr(tracing.random, "random", lambda: 0.1)
+    with tracing.span("root"):
+        with tracing.span("child"):
+            pass
+    assert [e["name"] for e in tracing._events] == ["child", "root"]
+
+
+def test_export_chrome_trace_shape(tmp_path):
+    tracing.enable()
+    with tracing.span("execute", "10.0.0.1:5888", 0x9B):
+        pass
+    path = tmp_path / "trace.json"
+    assert tracing.export_chrome_trace(str(path)) == 1
+    trace = json.loads(path.read_text(encoding="utf-8"))
+    event, = trace["traceEvents"]
+    assert event["ph"] == "X"
+    assert event["name"] == "execute"
+    assert isinstance(event["ts"], float) and isinstance(event["dur"], float)
+    assert event["dur"] >= 0
@@ -0,0 +1,174 @@
+# === tracing.py ===
+# 輕量追蹤 / Lightweight span tracing with Chrome trace-event export
+import functools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+_enabled = False
+_sample_rate = 1.0
+_events = deque(maxlen=100000)
+_local = threading.local()
+_pid = os.getpid()
+
+
+class _NoopSpan:
+    # 關閉時共用 / Shared do-nothing span used while tracing is off
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _SuppressedSpan:
+    # 未抽樣的根 span, 讓子 span 一起略過 / Unsampled root; keeps children unsampled too
+    __slots__ = ()
+
+    def __enter__(self):
+        _local.depth = getattr(_local, "depth", 0) + 1
+        return self
+
+    def __exit__(self, *exc):
+        _local.depth -= 1
+        if _local.depth == 0:
+            _local.sampled = False
+        return False
+
+
+_SUPPRESSED = _SuppressedSpan()
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault("stack", [])
+        if stack:
+            # 子 span 繼承機器與命令 / inherit machine and command from the parent
+            for key, value in stack[-1].args.items():
+                self.args.setdefault(key, value)
+        stack.append(self)
+        _local.depth = getattr(_local, "depth", 0) + 1
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        _local.stack.pop()
+        _local.depth -= 1
+        if _local.depth == 0:
+            _local.sampled = False
+        _events.append({
+            "name": self.name, "cat": "socket", "ph": "X",
+            # 浮點微秒, 保留次微秒 span / float microseconds keep sub-µs spans
+            "ts": self.start / 1000, "dur": (end - self.start) / 1000,
+            "pid": _pid, "tid": threading.get_ident(), "args": self.args,
+        })
+        return False
+
+
+def _machine_name(machine):
+    if machine is None or isinstance(machine, str):
+        return machine
+    try:
+        host, port = machine.getpeername()[:2]
+        return f"{host}:{port}"
+    except (OSError, AttributeError):
+        return None
+
+
+def span(name, machine=None, cmd=None):
+    # 建立 span, machine 可為 socket 或字串 / machine may be a socket or a "host:port" string
+    if not _enabled:
+        return _NOOP
+    if getattr(_local, "depth", 0) == 0:
+        _local.sampled = _sample_rate >= 1.0 or random.random() < _sample_rate
+    if not _local.sampled:
+        return _SUPPRESSED
+    args = {}
+    machine = _machine_name(machine)
+    if machine is not None:
+        args["machine"] = machine
+    if cmd is not None:
+        args["cmd"] = f"0x{cmd:02X}"
+    return _Span(name, args)
+
+
+def traced(name):
+    # 函式層級 span / Decorator wrapping a whole function in a span
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracedLock:
+    # 記錄等待時間的鎖 / Lock whose acquisition wait is recorded as a span
+    def __init__(self, name):
+        self.name = name + ".wait"
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        if not _enabled:
+            return self._lock.acquire(blocking, timeout)
+        with span(self.name):
+            return self._lock.acquire(blocking, timeout)
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+def enable(sample_rate=1.0):
+    # 開啟追蹤, sample_rate 為根 span 抽樣比例 / sample_rate applies per root span
+    global _enabled, _sample_rate
+    _sample_rate = sample_rate
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def clear():
+    _events.clear()
+
+
+def export_chrome_trace(path):
+    # 匯出 Chrome trace JSON (Perfetto 可開啟) / Write Chrome trace-event JSON for Perfetto
+    events = list(_events)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    print(f"[TRACE] Wrote {len(events)} spans to {path}")
+    return len(events)
+